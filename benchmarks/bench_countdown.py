@@ -0,0 +1,35 @@
+"""Times the countdown texts of running reminders, built on first use and interned.
+
+Run from the repository root: python -m benchmarks.bench_countdown
+"""
+import random
+import timeit
+
+from core.calendar import COUNTDOWN_TEXTS, countdown, format_seconds
+
+
+def main():
+    generator = random.Random(24)
+    # a minute of ticks of 1000 running reminders up to three days away
+    seconds = [generator.uniform(-3600, 3 * 86400) for _ in range(1000)]
+
+    def cold():
+        COUNTDOWN_TEXTS.clear()
+        for value in seconds:
+            format_seconds(value)
+
+    def warm():
+        for value in seconds:
+            format_seconds(value)
+
+    def with_change():
+        for value in seconds:
+            countdown(value)
+
+    for name, function in (('cold', cold), ('warm', warm), ('countdown', with_change)):
+        best = min(timeit.repeat(function, number=20, repeat=5)) / 20
+        print(f'{name:<10} {best / len(seconds) * 1e9:8.0f} ns per text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Compares the cost of parsing a calendar entry cold and taking it from the event cache.
+
+Run from the repository root: python -m benchmarks.bench_event_cache
+"""
+import datetime
+import time
+
+from core.calendar import EventCache, TIMEZONE, parse_datetime
+
+
+def entries(count=1000):
+    start = TIMEZONE.localize(datetime.datetime(2026, 10, 19, 8, 0))
+    for index in range(count):
+        event_start = start + datetime.timedelta(hours=index)
+        yield {'id': f'event{index}', 'updated': f'2026-10-01T00:00:{index % 60:02d}.000Z',
+               'summary': f'Vorlesung {index}', 'organizer': {'displayName': 'BAC1A'},
+               'description': '<p>Bitte <b>Laptop</b> und <a href="https://example.org">Skript</a> mitbringen</p>',
+               'location': 'R1.007', 'calendarColorId': '#16a765',
+               'start': {'dateTime': event_start.isoformat()},
+               'end': {'dateTime': (event_start + datetime.timedelta(minutes=90)).isoformat()}}
+
+
+def main():
+    events = list(entries())
+    cache = EventCache()
+
+    parse_datetime.cache_clear()
+    start = time.perf_counter()
+    for event in events:
+        cache.get(event)
+    cold = time.perf_counter() - start
+
+    rounds = 20
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for event in events:
+            cache.get(event)
+    warm = (time.perf_counter() - start) / rounds
+
+    print(f'cold {cold / len(events) * 1e6:8.1f} µs per entry')
+    print(f'warm {warm / len(events) * 1e6:8.1f} µs per entry')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Compares the linear member and study group lookups with the indexes of UfffBot
+on a synthetic guild with 10,000 members.
+
+Run from the repository root: python -m benchmarks.bench_lookups
+"""
+import random
+import timeit
+import types
+
+import discord
+
+from core.bot import UfffBot
+from core.models import Semester, StudyGroup
+
+
+def main():
+    members = [types.SimpleNamespace(id=member_id) for member_id in range(10000)]
+    members_by_id = {member.id: member for member in members}
+    guild = types.SimpleNamespace(members=members, get_member=members_by_id.get)
+
+    semesters = [Semester(year) for year in range(1, 8)]
+    for semester in semesters:
+        semester.groups = [StudyGroup(f'BAC{semester.year}{letter}', discord.Object(id=semester.year * 10 + index),
+                                      semester) for index, letter in enumerate('ABCD')]
+    study_groups = [group for semester in semesters for group in semester.groups]
+
+    bot = UfffBot.__new__(UfffBot)
+    bot.guild = guild
+    bot.study_groups = study_groups
+    bot.index_study_groups()
+
+    generator = random.Random(15)
+    member_ids = [generator.randrange(10000) for _ in range(1000)]
+    group_names = [generator.choice(study_groups).name for _ in range(1000)]
+
+    lookups = {
+        'member, linear': lambda: [discord.utils.get(guild.members, id=member_id) for member_id in member_ids],
+        'member, index': lambda: [bot.get_member(member_id) for member_id in member_ids],
+        'group, linear': lambda: [next(group for group in study_groups if group.name == name)
+                                  for name in group_names],
+        'group, index': lambda: [bot.groups_by_name[name.upper()] for name in group_names],
+    }
+    for name, function in lookups.items():
+        best = min(timeit.repeat(function, number=3, repeat=3)) / 3
+        print(f'{name:<16} {best / 1000 * 1e6:10.2f} µs per lookup')
+
+
+if __name__ == '__main__':
+    main()
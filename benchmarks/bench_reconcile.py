@@ -0,0 +1,21 @@
+"""Times the reconciliation of 5,000 fetched calendar entries with 5,000 existing reminders.
+
+Run from the repository root: python -m benchmarks.bench_reconcile
+"""
+import timeit
+import types
+
+from core.calendar import reconcile
+
+
+def main():
+    # half of the entries are unchanged, a tenth updated, the rest new or deleted
+    reminders = {f'event{index}': types.SimpleNamespace(updated_stamp='1') for index in range(5000)}
+    events = [{'id': f'event{index}', 'updated': '2' if index % 10 == 0 else '1'} for index in range(2500, 7500)]
+
+    best = min(timeit.repeat(lambda: reconcile(reminders, events), number=20, repeat=5)) / 20
+    print(f'reconcile  {best * 1000:8.2f} ms for {len(events)} entries and {len(reminders)} reminders')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,39 @@
+import importlib
 import logging
 import asyncio
+import os
+import time
 
 import discord
+import yaml
 from discord.ext import tasks
 from discord.ext.commands import bot
 
+from core.broadcast import Broadcaster
 from core.commands import Commands
+from core.configvalidator import load as load_config
+from core.metrics import Metrics, instrument_http, monitor_loop_lag, serve as serve_metrics
 from core.models import StudyGroup, Semester
-from core.setup import setup_dialog
+from core.setup import setup_dialog, SetupDialogs, SetupStore
+from core.storage import Storage
 
 
 class UfffBot(bot.Bot):
-    def __init__(self, command_prefix, config, secrets, datapath, **kwargs):
+    # optional subsystems, imported when their cog is loaded: (module, cog class)
+    subsystems = [('core.rss', 'FeedManager'), ('core.calendar', 'Calendar')]
+
+    def __init__(self, command_prefix, config, secrets, datapath, configpath='config.yml',
+                 startup_times=None, profile_startup=False, **kwargs):
         super().__init__(command_prefix, **kwargs)
 
+        # points in time the startup stages finished at, see startup_report()
+        self.startup_times = startup_times or {'start': time.perf_counter()}
+        self.profile_startup = profile_startup
+        self.initialised = False
+
         self.config = config
+        self.configpath = configpath
+        self.config_modified = None
         self.datapath = datapath
         self.secrets = secrets
 
@@ -28,9 +47,56 @@ class UfffBot(bot.Bot):
         self.channels = {}
         self.semesters = []
         self.study_groups = []
+        self.group_role_ids = frozenset()
+
+        # lookup indexes, kept up to date by the guild role and channel events
+        self.groups_by_name = {}
+        self.role_index = {}
+        self.channel_index = {}
+
+        # futures of the dialogs waiting for an answer, keyed by (channel id, user id)
+        self.dialogs = {}
+        self.add_listener(self.route_message, 'on_message')
+
+        self.storage = Storage(self.datapath / 'uf3bot.db')
+
+        self.setup_dialogs = SetupDialogs(self, SetupStore(self.storage))
+        self.broadcaster = Broadcaster(self, self.datapath / 'broadcasts', {'setup': setup_dialog})
+
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.loop_lag = None
+        instrument_http(self.http, self.metrics)
+        self.metrics.gauge('uf3bot_open_dialogs', 'Dialogs waiting for an answer', ('kind',),
+                           collect=lambda: {('input',): self.open_dialogs, ('setup',): len(self.setup_dialogs)})
+        self.metrics.gauge('uf3bot_asyncio_tasks', 'Running asyncio tasks',
+                           collect=lambda: {(): len(asyncio.all_tasks())})
+
+    async def close(self):
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        await self.storage.flush()
+        await super().close()
+
+    async def on_connect(self):
+        self.startup_times.setdefault('login', time.perf_counter())
 
     async def on_ready(self):
-        self.app_id = (await self.application_info()).id
+        # on_ready is dispatched again after every reconnect
+        if self.initialised:
+            await self.change_presence(status=discord.Status.online, activity=discord.Game(self.presence))
+            return
+        self.initialised = True
+        self.startup_times['guild ready'] = time.perf_counter()
+
+        self.parse_config()
+        self.add_cog(Commands(self))
+
+        app_info, *_ = await asyncio.gather(self.application_info(),
+                                            self.broadcaster.resume(),
+                                            *(self.load_subsystem(module, cog) for module, cog in self.subsystems))
+        self.app_id = app_info.id
+        self.startup_times['cogs ready'] = time.perf_counter()
 
         print("-------------------------")
         print('Logged in as:')
@@ -40,35 +106,111 @@ class UfffBot(bot.Bot):
         print(f'https://discordapp.com/oauth2/authorize?client_id={self.app_id}&scope=bot')
         print("-------------------------")
 
-        self.parse_config()
+        if self.profile_startup:
+            print(self.startup_report())
+            print("-------------------------")
+        else:
+            logging.info(self.startup_report())
 
-        self.add_cog(Commands(self))
+        # the resumed dialogs are paced, so they are not waited for
+        asyncio.create_task(self.setup_dialogs.resume())
         self.tasks.start()
+        self.watch_config.start()
+        self.loop_lag = asyncio.create_task(monitor_loop_lag(self.metrics))
+        await self.start_metrics_server()
         await self.change_presence(status=discord.Status.online, activity=discord.Game(self.presence))
 
+    async def load_subsystem(self, module_name, cog_name):
+        """Imports a subsystem in an executor, so slow imports do not block the event loop,
+        and adds its cog. Subsystems whose dependencies are missing are skipped."""
+        loop = asyncio.get_running_loop()
+        try:
+            module = await loop.run_in_executor(None, importlib.import_module, module_name)
+        except ImportError as error:
+            logging.warning(f'{cog_name} disabled, could not import {module_name}: {error}')
+            return
+
+        self.startup_times[f'{cog_name} imported'] = time.perf_counter()
+        self.add_cog(getattr(module, cog_name)(self))
+
+    async def start_metrics_server(self):
+        """Serves the metrics in the Prometheus text format if a port is configured"""
+        metrics_config = self.config.get('metrics', {})
+        if 'port' not in metrics_config:
+            return
+        host = metrics_config.get('host', '127.0.0.1')
+        try:
+            self.metrics_server = await serve_metrics(self.metrics, host, metrics_config['port'])
+        except OSError as error:
+            logging.warning(f'could not serve the metrics on {host}:{metrics_config["port"]}: {error}')
+
+    def startup_report(self):
+        """Returns how long each stage of the startup took"""
+        stages = sorted(self.startup_times.items(), key=lambda stage: stage[1])
+        start = previous = stages[0][1]
+        output = 'Startup timings:\n'
+        for stage, timestamp in stages[1:]:
+            output += f'{stage:<24}{timestamp - previous:8.3f}s\n'
+            previous = timestamp
+        output += f'{"total":<24}{previous - start:8.3f}s'
+        return output
+
     async def on_member_join(self, member):
         """When a new member joins the server, call the setup-dialog on him."""
-        await setup_dialog(self, member)
+        try:
+            await setup_dialog(self, member)
+        except discord.HTTPException:
+            logging.info(f'could not start the setup dialog of member "{member.name}"')
+
+    @property
+    def open_dialogs(self):
+        """The number of dialogs currently waiting for an answer"""
+        return len(self.dialogs)
 
-    async def userinput(self, channel, member):
-        queue = asyncio.Queue()
+    async def userinput(self, channel, member, timeout=None):
+        """Waits for the next message of :member: in :channel: and returns its content.
 
-        async def on_message(message):
-            if message.author.id == member.id and message.channel == channel:
-                await queue.put(message)
+        Raises asyncio.TimeoutError if no answer arrives within :timeout: seconds and
+        asyncio.CancelledError if the dialog is cancelled. A new dialog with the same
+        member in the same channel cancels the old one."""
+        key = (channel.id, member.id)
+        self.cancel_dialog(channel, member)
 
-        self.add_listener(on_message)
-        answer = await queue.get()
-        self.remove_listener(on_message)
+        future = asyncio.get_running_loop().create_future()
+        self.dialogs[key] = future
+        try:
+            answer = await asyncio.wait_for(future, timeout)
+        finally:
+            if self.dialogs.get(key) is future:
+                del self.dialogs[key]
         return answer.content
 
+    def cancel_dialog(self, channel, member):
+        """Cancels the dialog waiting for an answer of :member: in :channel:"""
+        future = self.dialogs.pop((channel.id, member.id), None)
+        if future is not None:
+            future.cancel()
+
+    async def route_message(self, message):
+        """Passes a message on to the dialog waiting for it"""
+        future = self.dialogs.get((message.channel.id, message.author.id))
+        if future is not None and not future.done():
+            future.set_result(message)
+        elif message.guild is None and message.author.id in self.setup_dialogs.store:
+            await self.setup_dialogs.handle(message)
+
     @tasks.loop(seconds=30)
     async def tasks(self):
         """Periodically logs the number of running asyncio tasks."""
         task_count = len(asyncio.all_tasks())
-        logging.debug(f'{task_count} asyncio tasks currently running.')
+        logging.debug(f'{task_count} asyncio tasks currently running, {self.open_dialogs} dialogs and '
+                      f'{len(self.setup_dialogs)} setup dialogs open.')
 
-    def parse_config(self):
+    def parse_config(self, old_config=None):
+        """Resolves the roles, channels and semesters of the config.
+
+        If the :old_config: the current state was resolved from is passed, only the parts of
+        the config that changed are resolved again. The new state replaces the old one at once."""
         # get guild from config
         for guild in self.guilds:
             if self.config['server']['id'] == guild.id:
@@ -78,42 +220,161 @@ class UfffBot(bot.Bot):
             logging.warning('The bot is not a member of the guild with the specified guild id')
             return
 
+        if old_config is None or old_config['server']['id'] != self.config['server']['id']:
+            old_config = None
+            self.role_index = {role.id: role for role in self.guild.roles}
+            self.channel_index = {channel.id: channel for channel in self.guild.channels}
+
+        def changed(*keys):
+            if old_config is None:
+                return True
+            old, new = old_config, self.config
+            for key in keys:
+                old, new = old.get(key), new.get(key)
+            return old != new
+
         self.command_prefix = self.config['bot']['prefix']
         self.presence = self.config['bot']['presence']
 
-        # get roles from config
-        for role_name, role_id in self.config['server']['roles'].items():
-            role = discord.utils.get(self.guild.roles, id=role_id)
-            if role:
-                self.roles.update({role_name: role})
+        roles = self.roles
+        if changed('server', 'roles'):
+            roles = self.resolve(self.config['server']['roles'], self.role_index, 'role')
+
+        channels = self.channels
+        if changed('server', 'channels'):
+            channels = self.resolve(self.config['server']['channels'], self.channel_index, 'channel')
+
+        # get semesters from config, semesters that did not change are kept
+        old_semesters = {semester.year: semester for semester in self.semesters}
+        semesters = []
+        for sem_year, semester in self.config['server']['semesters'].items():
+            if sem_year in old_semesters and not changed('server', 'semesters', sem_year):
+                semesters.append(old_semesters[sem_year])
             else:
-                logging.warning(f'role "{role_name}" not found in guild "{self.guild.name}"')
+                semesters.append(self.parse_semester(sem_year, semester))
+
+        self.roles = roles
+        self.channels = channels
+        self.semesters = semesters
+        self.study_groups = [group for semester in semesters for group in semester.groups]
+        self.index_study_groups()
 
-        # get channels from config
-        for channel_name, channel_id in self.config['server']['channels'].items():
-            channel = discord.utils.get(self.guild.channels, id=channel_id)
-            if channel:
-                self.channels.update({channel_name: channel})
+    def resolve(self, config_section, index, kind):
+        """Returns a dict of the names in :config_section: and the objects their ids belong to"""
+        resolved = {}
+        for name, object_id in config_section.items():
+            found = index.get(object_id)
+            if found:
+                resolved[name] = found
             else:
-                logging.warning(f'channel "{channel_name}" not found in guild "{self.guild.name}"')
+                logging.warning(f'{kind} "{name}" not found in guild "{self.guild.name}"')
+        return resolved
 
-        # get semesters from config
-        for sem_year, semester in self.config['server']['semesters'].items():
-            new_semester = Semester(sem_year)
+    def parse_semester(self, sem_year, semester):
+        new_semester = Semester(sem_year)
+
+        sem_channel = self.channel_index.get(semester['channel'])
+        if sem_channel:
+            new_semester.channel = sem_channel
+        else:
+            logging.warning(f'channel of {new_semester} not found in guild "{self.guild}"')
 
-            sem_channel = discord.utils.get(self.guild.channels, id=semester['channel'])
-            if sem_channel:
-                new_semester.channel = sem_channel
+        for gr_name, gr_id in semester['groups'].items():
+            gr_role = self.role_index.get(gr_id)
+            if gr_role:
+                new_semester.groups.append(StudyGroup(gr_name, gr_role, new_semester))
             else:
-                logging.warning(f'channel of {new_semester} not found in guild "{self.guild}"')
-
-            for gr_name, gr_id in semester['groups'].items():
-                gr_role = discord.utils.get(self.guild.roles, id=gr_id)
-                if gr_role:
-                    new_group = StudyGroup(gr_name, gr_role, new_semester)
-                    new_semester.groups.append(new_group)
-                    self.study_groups.append(new_group)
-                else:
-                    logging.warning(f'role "{gr_name}" not found in guild "{self.guild}"')
-
-            self.semesters.append(new_semester)
+                logging.warning(f'role "{gr_name}" not found in guild "{self.guild}"')
+
+        return new_semester
+
+    async def reload_config(self):
+        """Loads config.yml again and applies the changes without restarting the bot.
+        Returns False if the file is invalid, the current config is kept in that case."""
+        try:
+            new_config = load_config(self.configpath)
+        except (OSError, yaml.YAMLError) as error:
+            logging.warning(f'could not load config: {error}')
+            return False
+        if new_config is None:
+            return False
+
+        old_config, self.config = self.config, new_config
+        self.parse_config(old_config)
+        self.dispatch('config_reload', old_config)
+
+        if old_config['bot']['presence'] != new_config['bot']['presence']:
+            await self.change_presence(status=discord.Status.online, activity=discord.Game(self.presence))
+        return True
+
+    # the tasks method above shadows the tasks module in the class body
+    @discord.ext.tasks.loop(seconds=10)
+    async def watch_config(self):
+        """Reloads the config whenever config.yml was modified"""
+        try:
+            modified = os.stat(self.configpath).st_mtime
+        except OSError:
+            return
+
+        if self.config_modified is None:
+            self.config_modified = modified
+        elif modified != self.config_modified:
+            self.config_modified = modified
+            logging.info('config.yml was modified, reloading it')
+            await self.reload_config()
+
+    def index_study_groups(self):
+        self.groups_by_name = {group.name.upper(): group for group in self.study_groups}
+        self.group_role_ids = frozenset(group.role.id for group in self.study_groups)
+
+    def get_member(self, member_id):
+        """Looks a member of the guild up by its id"""
+        return self.guild.get_member(member_id) if self.guild else None
+
+    async def on_guild_role_create(self, role):
+        if role.guild == self.guild:
+            self.role_index[role.id] = role
+
+    async def on_guild_role_update(self, before, after):
+        if after.guild == self.guild:
+            self.role_index[after.id] = after
+
+    async def on_guild_role_delete(self, role):
+        if role.guild != self.guild:
+            return
+        self.role_index.pop(role.id, None)
+
+        for role_name, configured_role in list(self.roles.items()):
+            if configured_role.id == role.id:
+                logging.warning(f'role "{role_name}" was deleted from guild "{self.guild}"')
+                del self.roles[role_name]
+
+        if role.id in self.group_role_ids:
+            logging.warning(f'role of study group "{role.name}" was deleted from guild "{self.guild}"')
+            self.study_groups = [group for group in self.study_groups if group.role.id != role.id]
+            for semester in self.semesters:
+                semester.groups = [group for group in semester.groups if group.role.id != role.id]
+            self.index_study_groups()
+
+    async def on_guild_channel_create(self, channel):
+        if channel.guild == self.guild:
+            self.channel_index[channel.id] = channel
+
+    async def on_guild_channel_update(self, before, after):
+        if after.guild == self.guild:
+            self.channel_index[after.id] = after
+
+    async def on_guild_channel_delete(self, channel):
+        if channel.guild != self.guild:
+            return
+        self.channel_index.pop(channel.id, None)
+
+        for channel_name, configured_channel in list(self.channels.items()):
+            if configured_channel.id == channel.id:
+                logging.warning(f'channel "{channel_name}" was deleted from guild "{self.guild}"')
+                del self.channels[channel_name]
+
+        for semester in self.semesters:
+            if semester.channel and semester.channel.id == channel.id:
+                logging.warning(f'channel of {semester} was deleted from guild "{self.guild}"')
+                semester.channel = None
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+import discord
+
+from core.utils import send_more
+
+
+class TokenBucket:
+    """Allows :rate: operations per second with bursts of up to :capacity: operations"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+                self.timestamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastJob:
+    """A command that is run for every recipient of a broadcast
+
+    Parameters
+    ----------
+    job_id:     The id of the job, used as its file name
+    command:    The name of the command run for every recipient
+    recipients: The ids of all recipients, without duplicates
+    channel_id: The id of the channel the progress is reported to
+    done:       The ids of the recipients the command was already run for
+    failures:   A dict of recipient ids and the error the command failed with
+    """
+
+    def __init__(self, job_id, command, recipients, channel_id, done=(), failures=None):
+        self.id = job_id
+        self.command = command
+        self.recipients = list(dict.fromkeys(recipients))
+        self.channel_id = channel_id
+        self.done = set(done)
+        self.failures = failures or {}
+
+    @property
+    def remaining(self):
+        return [member_id for member_id in self.recipients if member_id not in self.done]
+
+    def to_dict(self):
+        return {'id': self.id, 'command': self.command, 'recipients': self.recipients,
+                'channel_id': self.channel_id, 'done': list(self.done), 'failures': self.failures}
+
+    @classmethod
+    def from_dict(cls, data):
+        failures = {int(member_id): error for member_id, error in data['failures'].items()}
+        return cls(data['id'], data['command'], data['recipients'], data['channel_id'], data['done'], failures)
+
+
+class Broadcaster:
+    """Runs broadcast jobs at a pace discord's rate limits can keep up with.
+
+    The commands are started through a token bucket and at most :concurrency: of them run
+    at the same time. The progress of a job is reported to the channel it was started in
+    every :progress_interval: seconds and saved to disk every :save_interval: seconds, so
+    jobs that were interrupted by a restart are resumed by :meth:`resume`.
+
+    Parameters
+    ----------
+    bot:        The bot the recipients are members of
+    path:       The directory the jobs are saved in
+    actions:    A dict of command names and coroutine functions taking the bot and a member
+    """
+    rate = 2
+    burst = 5
+    concurrency = 4
+    progress_interval = 30
+    save_interval = 5
+
+    def __init__(self, bot, path, actions):
+        self.bot = bot
+        self.path = path
+        self.actions = actions
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.jobs = {}
+
+    def create(self, command, members, channel):
+        job = BroadcastJob(uuid.uuid4().hex, command, [member.id for member in members], channel.id)
+        self.save(job)
+        return job
+
+    def start(self, job):
+        self.jobs[job.id] = asyncio.create_task(self.run(job))
+
+    async def resume(self):
+        """Starts all jobs that were interrupted"""
+        if not self.path.is_dir():
+            return
+        for file in self.path.glob('*.json'):
+            with file.open('r') as job_file:
+                job = BroadcastJob.from_dict(json.load(job_file))
+            if job.id not in self.jobs:
+                logging.info(f'resuming broadcast "{job.command}" with {len(job.remaining)} remaining recipients')
+                self.start(job)
+
+    def save(self, job):
+        """Writes the job to a temporary file first, so a crash never leaves a broken job file"""
+        self.path.mkdir(exist_ok=True)
+        temp_path = self.path / f'{job.id}.tmp'
+        with temp_path.open('w') as file:
+            json.dump(job.to_dict(), file)
+        os.replace(temp_path, self.path / f'{job.id}.json')
+
+    def remove(self, job):
+        try:
+            (self.path / f'{job.id}.json').unlink()
+        except FileNotFoundError:
+            pass
+        self.jobs.pop(job.id, None)
+
+    async def run(self, job):
+        channel = self.bot.get_channel(job.channel_id)
+        action = self.actions[job.command]
+        queue = asyncio.Queue()
+        for member_id in job.remaining:
+            queue.put_nowait(member_id)
+
+        async def worker():
+            while not queue.empty():
+                member_id = queue.get_nowait()
+                await self.bucket.acquire()
+                member = self.bot.get_member(member_id)
+                try:
+                    if member is None:
+                        raise LookupError('not a member of the server anymore')
+                    await action(self.bot, member)
+                except (LookupError, AttributeError, discord.HTTPException) as error:
+                    job.failures[member_id] = str(error)
+                job.done.add(member_id)
+
+        pending = {asyncio.create_task(worker()) for _ in range(self.concurrency)}
+        last_report = time.monotonic()
+        while pending:
+            finished, pending = await asyncio.wait(pending, timeout=self.save_interval)
+            self.save(job)
+            if channel and pending and time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                await channel.send(f'Broadcast "{job.command}": {len(job.done)}/{len(job.recipients)} erledigt, '
+                                   f'{len(job.failures)} fehlgeschlagen.')
+
+        self.remove(job)
+        if channel:
+            await channel.send(f'Broadcast "{job.command}" abgeschlossen: {len(job.recipients) - len(job.failures)} '
+                               f'von {len(job.recipients)} erfolgreich.')
+            if job.failures:
+                output = ''
+                for member_id, error in job.failures.items():
+                    member = self.bot.get_member(member_id)
+                    output += f'{member or member_id}: {error}\n'
+                await send_more(channel, output)
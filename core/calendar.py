@@ -1,237 +1,616 @@
 import asyncio
+import bisect
+import collections
 import datetime
+import functools
+import hashlib
+import heapq
+import itertools
+import logging
 import os
 import pickle
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.discovery_cache.base import Cache
+from googleapiclient.errors import HttpError
+import httplib2
 import dateutil.parser
 import discord
 import html2text as html2text
 from pytz import timezone
 from discord.ext import tasks, commands
 
-from core.utils import codeblock
+from core.utils import codeblock, send_more, is_admin
 
 
 TIMEZONE = timezone('Europe/Berlin')
 
 
-class Calendar(commands.Cog):
-    refresh_interval = 60
-
-    def __init__(self, eit):
-        self.eit = eit
-        self.reminders = []
+def current_time():
+    """The clock of the calendar, replaced by a frozen clock in tests"""
+    return datetime.datetime.now(TIMEZONE)
 
-        self.channels = {'admin': self.eit.admin_calendar}
-        for semester in self.eit.semester:
-            self.channels.update({semester.name: semester.announcement_channel})
-
-        asyncio.create_task(self.delete_messages())
 
+class Calendar(commands.Cog):
+    refresh_interval = 60
+    incremental_sync = True
+    lookahead_days = 7
+
+    def __init__(self, bot, clock=current_time):
+        self.bot = bot
+        self.reminders = {}
+        self.scheduler = ReminderScheduler(clock)
+        self.edits = EditCoalescer()
+        self.client = CalendarClient(bot.storage)
+
+        lookahead_days = bot.config.get('calendar', {}).get('lookahead_days', self.lookahead_days)
+        self.sync = CalendarSync(self.client, lookahead=datetime.timedelta(days=lookahead_days), clock=clock)
+        self.reminder_context = ReminderContext(self.scheduler, self.edits, bot.storage, self.reminders, clock)
+
+        self.fetch_latency = bot.metrics.histogram('uf3bot_calendar_fetch_seconds',
+                                                   'Duration of the calendar syncs', ('calendar',))
+        bot.metrics.gauge('uf3bot_reminders', 'Reminders by state', ('state',), collect=self.count_reminders)
+        bot.metrics.gauge('uf3bot_reminder_edits_pending', 'Reminder edits waiting to be sent',
+                          collect=lambda: {(): self.edits.depth})
+
+        self.channels = {}
+        self.router = None
+        self.build_router()
+
+        # reminder messages sent before the last restart, keyed by event id
+        self.stored_messages = {}
+        self.restored = False
+
+        self.scheduler.start()
         self.refresh.start()
+        self.refresh_credentials.start()
+
+    def cog_unload(self):
+        self.refresh.cancel()
+        self.refresh_credentials.cancel()
+        self.scheduler.stop()
+        self.edits.stop()
+        self.sync.close()
+
+    def build_router(self):
+        admin_calendar = self.bot.channels.get('admin_calendar')
+        self.channels = {'admin': admin_calendar}
+        for semester in self.bot.semesters:
+            self.channels.update({str(semester): semester.channel})
+
+        self.router = ChannelRouter(admin_calendar, self.bot.semesters)
+
+    def count_reminders(self):
+        """Returns the number of reminders waiting for their reminder time and of running ones"""
+        running = sum(1 for reminder in self.reminders.values() if reminder.is_running)
+        return {('waiting',): len(self.reminders) - running, ('running',): running}
+
+    @commands.Cog.listener()
+    async def on_config_reload(self, old_config):
+        """Routes new entries according to the new config, existing reminders stay where they are"""
+        self.build_router()
+
+    @tasks.loop(minutes=1)
+    async def refresh_credentials(self):
+        """Refreshes the google credentials before they expire, so refreshing the
+        calendar never has to wait for a token refresh"""
+        loop = asyncio.get_running_loop()
+        if self.client.credentials is None:
+            await loop.run_in_executor(None, self.client.load_credentials)
+        if self.client.credentials_expiring():
+            await loop.run_in_executor(None, self.client.refresh_credentials)
+            self.client.save_credentials()
 
     @tasks.loop(seconds=refresh_interval)
     async def refresh(self):
-        # Fetch the next 5 entries per calendar
+        # Fetch the changes and get all entries reminded of within the lookahead window,
+        # the reminders wait for their reminder time in the scheduler
         loop = asyncio.get_running_loop()
-        events = await loop.run_in_executor(None, fetch_entries)
-
-        # Check all current reminders for updates
-        for reminder in self.reminders:
-            for event in events:
-                if reminder.id == event['id']:
-                    event_updated = dateutil.parser.parse(event['updated']).astimezone(TIMEZONE)
-                    if event_updated != reminder.updated:
-                        reminder.update_reminder(event)
-                    events.remove(event)
-                    break
-            else:
-                reminder.delete_reminder()
+        if self.incremental_sync:
+            await self.sync.sync_concurrently()
+            for calendar_id, latency in self.sync.latencies.items():
+                calendar_name = self.sync.calendars.get(calendar_id, {}).get('summary', calendar_id)
+                self.fetch_latency.observe(latency, calendar_name)
+            events = self.sync.upcoming()
+        else:
+            events = await loop.run_in_executor(None, functools.partial(fetch_entries, service=self.client.service))
 
-        # Got new events
-        for event in events:
-            channel = self.eit.admin_calendar
-            for semester in self.eit.semester:
-                if semester.name.lower() in event["organizer"]["displayName"].lower():
-                    channel = semester.announcement_channel
+        added, updated, deleted = reconcile(self.reminders, events)
 
-                for study_group in semester.study_groups:
-                    if study_group.lower() in event["organizer"]["displayName"].lower():
-                        channel = semester.announcement_channel
-                        break
+        for reminder in deleted:
+            reminder.delete_reminder()
 
-            self.reminders.append(Reminder(self, event, channel))
+        for reminder, event in updated:
+            reminder.update_reminder(event)
 
-    async def delete_messages(self):
+        # Got new events, reattach the messages of reminders sent before a restart
+        messages = await asyncio.gather(*(self.fetch_stored_message(event['id']) for event in added))
+        for event, message in zip(added, messages):
+            if message:
+                channel = message.channel
+            else:
+                channel = self.router.route(event["organizer"]["displayName"])
+            if channel is None:
+                continue
+            self.reminders[event['id']] = Reminder(self.reminder_context, event, channel, message)
+
+        # after the first refresh every stored message left belongs to no reminder anymore
+        if not self.restored:
+            self.restored = True
+            await self.delete_orphans()
+
+    @refresh.before_loop
+    async def load_stored_messages(self):
+        rows = await self.bot.storage.fetch('SELECT event_id, channel_id, message_id FROM reminders')
+        self.stored_messages = {event_id: (channel_id, message_id) for event_id, channel_id, message_id in rows}
+
+    async def fetch_stored_message(self, event_id):
+        """Fetches the message a reminder of :event_id: was sent as before the last restart"""
+        if event_id not in self.stored_messages:
+            return None
+        channel_id, message_id = self.stored_messages.pop(event_id)
+
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return None
+        try:
+            return await channel.fetch_message(message_id)
+        except discord.HTTPException:
+            return None
+
+    async def delete_orphans(self):
+        """Deletes the reminder messages of the bot that belong to no current reminder,
+        in one bulk delete per channel"""
+        orphans = {}
+        for event_id, (channel_id, message_id) in self.stored_messages.items():
+            orphans.setdefault(channel_id, set()).add(message_id)
+            self.bot.storage.write('DELETE FROM reminders WHERE event_id = ?', (event_id,))
+        self.stored_messages = {}
+
+        # reminders the bot sent without remembering them. The new reminders send their messages
+        # while the history is fetched, so only messages sent before the scan are looked at.
+        scan_start = datetime.datetime.utcnow()
         for channel in self.channels.values():
-            await channel.purge()
+            if channel is None:
+                continue
+            async for message in channel.history(limit=100, before=scan_start):
+                if message.author == self.bot.user and message.embeds:
+                    orphans.setdefault(channel.id, set()).add(message.id)
+
+        for channel_id, message_ids in orphans.items():
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            # checked right before deleting, reattached and new reminders keep their messages
+            live_messages = {reminder.message.id for reminder in self.reminders.values() if reminder.message}
+            messages = [discord.Object(id=message_id) for message_id in message_ids - live_messages]
+            for chunk in range(0, len(messages), 100):
+                try:
+                    await channel.delete_messages(messages[chunk:chunk + 100])
+                except discord.HTTPException:
+                    # bulk deletes fail for messages older than 14 days
+                    for message in messages[chunk:chunk + 100]:
+                        try:
+                            await self.bot.http.delete_message(channel_id, message.id)
+                        except discord.HTTPException:
+                            pass
 
     @commands.command()
     async def ongoing(self, context):
         """Zeigt alle laufenden Termine an"""
-        output = ''
-        if not self.reminders:
+        # the reminders waiting for their reminder time within the lookahead window are not running
+        running = [reminder for reminder in self.reminders.values() if reminder.is_running]
+        if not running:
             await context.channel.send('Es gibt momentan keine laufenden Termine!')
         else:
-            for reminder in self.reminders:
-                if reminder.is_running:
-                    output += f'{reminder.calendar_name}: {reminder.summary}\n'
+            output = ''
+            for reminder in running:
+                output += f'{reminder.event.calendar_name}: {reminder.event.summary}\n'
             await context.channel.send(codeblock(output))
 
+    @commands.command()
+    async def calendars(self, context):
+        """Zeigt an, wie lange das Abrufen der einzelnen Kalender gedauert hat"""
+        if not self.sync.latencies:
+            await context.channel.send('Es wurden noch keine Kalender abgerufen!')
+            return
 
-class Reminder:
-    def __init__(self, calendar_object, event, channel):
-        self.calendar_object = calendar_object
+        output = ''
+        for calendar_id, latency in sorted(self.sync.latencies.items(), key=lambda item: item[1], reverse=True):
+            calendar_name = self.sync.calendars.get(calendar_id, {}).get('summary', calendar_id)
+            output += f'{latency * 1000:6.0f} ms  {calendar_name}\n'
+        await send_more(context.channel, output)
 
-        self.id = event['id']
-        self.updated = dateutil.parser.parse(event['updated']).astimezone(TIMEZONE)
-        self.is_running = False
+    @is_admin()
+    @commands.command()
+    async def routing(self, context):
+        """Zeigt an, in welche Channel die Termine der Kalender gesendet werden"""
+        output = ''
+        for key, channel in self.router.table():
+            output += f'{key:<20} -> #{channel}\n'
+        output += f'{"(sonstige)":<20} -> #{self.router.default_channel}\n'
+        await send_more(context.channel, output)
 
-        self.channel = channel
-        self.message = None
-        self.embed = None
-
-        # event attributes
-        self.calendar_name = None
-        self.summary = None
-        self.event_start = None
-        self.event_end = None
-        self.event_duration = None
-        self.reminder_start = None
-        self.description = None
-        self.location = None
-        self.colour = None
-
-        self.parse_event(event)
-        self.generate_embed()
-
-        self.task = asyncio.create_task(self.refresh())
-
-    async def refresh(self, refresh_interval=20):
-        while True:
-            try:
-                now = datetime.datetime.now(TIMEZONE)
-                if self.event_end <= now:
-                    self.delete_reminder()
-                elif self.reminder_start <= now:
-                    self.set_embed_title()
-                    if self.message:
-                        await self.update_message()
-                    else:
-                        self.is_running = True
-                        self.message = await self.channel.send(embed=self.embed)
-                elif self.message:
-                    await self.delete_message()
+    @commands.command()
+    async def timers(self, context):
+        """Zeigt die Anzahl der geplanten Erinnerungs-Timer an"""
+        await context.channel.send(f'Es sind momentan {self.scheduler.pending} Timer geplant und '
+                                   f'{self.edits.depth} Bearbeitungen ausstehend.')
 
-                await asyncio.sleep(refresh_interval)
 
-            except asyncio.CancelledError:
-                pass
+class ChannelRouter:
+    """Maps the organizer name of a calendar to the channel its entries are sent to.
 
-    async def delete_message(self):
-        try:
-            await self.message.delete()
-        except discord.NotFound:
-            pass
+    All study group and semester names are matched case-insensitively in a single
+    pass of one precompiled regex. If several names occur in the organizer name,
+    study groups win over semesters and earlier entries in the config win over later
+    ones. The result is cached per organizer name.
+    """
 
-    async def update_message(self):
+    def __init__(self, default_channel, semesters):
+        self.default_channel = default_channel
+        self.routes = {}
+        self.cache = {}
+
+        for index, semester in enumerate(semesters):
+            if semester.channel is None:
+                continue
+            for study_group in semester.groups:
+                self.add_route(study_group.name, (0, index), semester.channel)
+            self.add_route(str(semester), (1, index), semester.channel)
+
+        # longer names first, so a study group is not shadowed by a part of its name
+        keys = sorted(self.routes, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(key) for key in keys)) if keys else None
+
+    def add_route(self, name, priority, channel):
+        key = str(name).lower()
+        if key and (key not in self.routes or priority < self.routes[key][0]):
+            self.routes[key] = (priority, channel)
+
+    def route(self, organizer):
+        """Returns the channel for entries of the calendar named :organizer:"""
         try:
-            await self.message.edit(embed=self.embed)
-        except discord.NotFound:
+            return self.cache[organizer]
+        except KeyError:
             pass
 
-    def delete_reminder(self):
-        self.task.cancel()
-        asyncio.create_task(self.delete_message())
+        channel = self.default_channel
+        if self.pattern:
+            matches = [self.routes[match.group(0)] for match in self.pattern.finditer(organizer.lower())]
+            if matches:
+                channel = min(matches, key=lambda route: route[0])[1]
+
+        self.cache[organizer] = channel
+        return channel
+
+    def table(self):
+        """Returns all (name, channel) routes in the order of their priority"""
+        return [(key, channel) for key, (priority, channel) in sorted(self.routes.items(), key=lambda item: item[1][0])]
+
+
+def reconcile(reminders, events):
+    """Compares fetched calendar entries with the existing reminders in a single pass
+
+    Parameters
+    ----------
+    reminders:  A dict of the existing reminders keyed by their event id
+    events:     The fetched calendar entries
+
+    Returns
+    -------
+    The entries without reminder, a list of (reminder, entry) tuples of reminders
+    whose entry was updated and the reminders whose entry is gone
+    """
+    added = []
+    updated = []
+    seen = set()
+    for event in events:
+        seen.add(event['id'])
+        reminder = reminders.get(event['id'])
+        if reminder is None:
+            added.append(event)
+        elif reminder.updated_stamp != event['updated']:
+            updated.append((reminder, event))
+
+    deleted = [reminder for event_id, reminder in reminders.items() if event_id not in seen]
+    return added, updated, deleted
+
+
+class ReminderScheduler:
+    """Wakes up reminders at the moment they need to be refreshed.
+
+    All reminders share a single heap of (wakeup time, reminder) entries and a
+    single task that sleeps until the earliest entry is due, instead of every
+    reminder polling the clock in its own loop."""
+
+    def __init__(self, clock=current_time):
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task = None
+
+    @property
+    def pending(self):
+        """The number of reminders currently waiting for a wakeup"""
+        return len(self._entries)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, reminder, when):
+        """(Re)schedules :reminder: to be refreshed at :when:"""
+        entry = [when, next(self._counter), reminder]
+        old_entry = self._entries.pop(reminder, None)
+        if old_entry:
+            old_entry[-1] = None
+        self._entries[reminder] = entry
+        heapq.heappush(self._heap, entry)
+
+        # wake the scheduler up if this entry is due before everything else
+        if self._heap[0] is entry:
+            self._changed.set()
+
+    def cancel(self, reminder):
+        entry = self._entries.pop(reminder, None)
+        if entry:
+            entry[-1] = None
+
+    def pop_due(self, now):
+        """Removes the reminders due at :now: from the heap and returns them, the earliest first"""
+        due = []
+        while self._heap and (self._heap[0][-1] is None or self._heap[0][0] <= now):
+            when, _, reminder = heapq.heappop(self._heap)
+            if reminder is not None:
+                del self._entries[reminder]
+                due.append(reminder)
+        return due
+
+    async def _run(self):
+        while True:
+            now = self.clock()
+            for reminder in self.pop_due(now):
+                asyncio.create_task(self._fire(reminder))
+
+            if self._heap:
+                timeout = (self._heap[0][0] - now).total_seconds()
+            else:
+                timeout = None
+
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, reminder):
         try:
-            self.calendar_object.reminders.remove(self)
-        except ValueError:
-            pass
+            await reminder.refresh()
+        except Exception:
+            logging.exception(f'refreshing reminder "{reminder.event.summary}" failed')
+            # try again later instead of dropping the reminder
+            if not reminder.deleted:
+                self.schedule(reminder, self.clock() + Reminder.retry_delay)
+
+
+class EditCoalescer:
+    """Sends the embed edits of reminder messages.
+
+    Edits are queued per channel and every channel gets at most one edit per
+    :edit_interval: seconds, so many running reminders in one channel do not run into
+    discord's rate limit. If a message is edited again before its last edit was sent,
+    only the newest embed is sent."""
+    edit_interval = 1
+
+    def __init__(self):
+        self.pending = {}
+        self.workers = {}
+
+        self.sent = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self):
+        """The number of edits waiting to be sent"""
+        return sum(len(edits) for edits in self.pending.values())
+
+    def edit(self, message, embed):
+        channel_id = message.channel.id
+        edits = self.pending.setdefault(channel_id, {})
+        if message.id in edits:
+            self.coalesced += 1
+        edits[message.id] = (message, embed)
+
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self._work(channel_id))
+
+    def discard(self, message):
+        """Drops the queued edit of a message that is about to be deleted"""
+        self.pending.get(message.channel.id, {}).pop(message.id, None)
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+    async def _work(self, channel_id):
+        edits = self.pending[channel_id]
+        try:
+            while edits:
+                message, embed = edits.pop(next(iter(edits)))
+                try:
+                    await message.edit(embed=embed)
+                    self.sent += 1
+                except discord.NotFound:
+                    pass
+                except discord.HTTPException as error:
+                    logging.warning(f'could not edit reminder message: {error}')
+                await asyncio.sleep(self.edit_interval)
+        finally:
+            del self.workers[channel_id]
+            if not edits:
+                del self.pending[channel_id]
+
+
+ReminderContext = collections.namedtuple('ReminderContext', ['scheduler', 'edits', 'storage', 'reminders', 'clock'])
+ReminderContext.__doc__ = """The parts of the :class:`Calendar` cog all reminders share"""
 
-    def update_reminder(self, event):
-        self.parse_event(event)
-        self.generate_embed()
-        if self.message:
-            self.set_embed_title()
-            asyncio.create_task(self.message.edit(embed=self.embed))
 
-    def parse_event(self, event):
-        self.updated = dateutil.parser.parse(event['updated']).astimezone(TIMEZONE)
+class Reminder:
+    """The reminder of a calendar entry, :message: is the message of a reminder that
+    was already sent before a restart.
 
-        # mandatory
-        self.calendar_name = event["organizer"]["displayName"]
-        self.summary = event["summary"]
-        self.event_start = parse_time(event, 'start')
+    The parsed entry in :attr:`event` is immutable and shared with :data:`EVENT_CACHE`, the
+    reminder itself only keeps the state of its message. The embed is rendered when the
+    message is sent or edited and not kept around.
+    """
+    __slots__ = ('context', 'id', 'updated_stamp', 'event', 'channel', 'message', 'last_rendered', 'deleted',
+                 'refreshing', 'refresh_again')
+    retry_delay = datetime.timedelta(seconds=20)
 
-        # optional
-        if 'end' in event:
-            self.event_end = parse_time(event, 'end')
-            self.event_duration = self.event_end - self.event_start
-        else:
-            self.event_end = None
-            self.event_duration = None
+    def __init__(self, context, event, channel, message=None):
+        self.context = context
+        self.id = event['id']
+        self.updated_stamp = event['updated']
+        self.event = EVENT_CACHE.get(event)
 
-        if 'reminders' in event and 'overrides' in event['reminders']:
-            remind_minutes = event['reminders']['overrides'][0]['minutes']
-        else:
-            remind_minutes = 30
-        self.reminder_start = self.event_start - datetime.timedelta(minutes=remind_minutes)
+        self.channel = channel
+        self.message = message
+        # the parsed entry and the title the message was last rendered with
+        self.last_rendered = None
+        self.deleted = False
+        # a refresh waiting for discord, refreshes meanwhile are run again when it is done
+        self.refreshing = False
+        self.refresh_again = False
 
-        if 'description' in event:
-            self.description = html2text.html2text(event['description'])
-        else:
-            self.description = ''
+        self.context.scheduler.schedule(self, self.context.clock())
 
-        if 'location' in event:
-            self.location = event['location']
-        else:
-            self.location = None
+    @property
+    def is_running(self):
+        return self.message is not None
+
+    async def refresh(self):
+        """Brings the reminder message up to date and schedules the next refresh"""
+        if self.refreshing:
+            # two refreshes at once would both send a message
+            self.refresh_again = True
+            return
 
-        if 'calendarColorId' in event:
-            self.colour = discord.Colour(int(event['calendarColorId'].lstrip('#'), 16))
+        self.refreshing = True
+        try:
+            wakeup = await self.refresh_message()
+        finally:
+            self.refreshing = False
+        if self.refresh_again:
+            self.refresh_again = False
+            wakeup = self.context.clock()
+
+        if not self.deleted:
+            self.context.scheduler.schedule(self, wakeup)
+
+    async def refresh_message(self):
+        """Sends, edits or deletes the reminder message and returns the time of the next refresh"""
+        now = self.context.clock()
+        if self.end <= now:
+            self.delete_reminder()
+            return None
+        elif self.event.reminder_start <= now:
+            title, seconds_until_change = self.title(now)
+            if self.message:
+                self.update_message(title)
+            else:
+                self.message = await self.channel.send(embed=self.render_embed(title))
+                if self.deleted:
+                    # the entry was deleted while the message was sent
+                    await self.delete_message()
+                    return None
+                self.last_rendered = (self.event, title)
+                self.context.storage.write('INSERT OR REPLACE INTO reminders VALUES (?, ?, ?)',
+                                           (self.id, self.channel.id, self.message.id))
+            # wake up one second after the countdown changed to be sure the title is different
+            return min(now + datetime.timedelta(seconds=seconds_until_change + 1), self.end)
         else:
-            self.colour = discord.Colour(0x000000)
+            if self.message:
+                await self.delete_message()
+                self.context.storage.write('DELETE FROM reminders WHERE event_id = ?', (self.id,))
+                self.message = None
+                self.last_rendered = None
+            return self.event.reminder_start
+
+    @property
+    def end(self):
+        """The time the reminder expires, events without an end expire when they start"""
+        return self.event.event_end or self.event.event_start
 
-    def generate_embed(self):
-        embed = discord.Embed(description=self.description, colour=self.colour)
+    async def delete_message(self):
+        self.context.edits.discard(self.message)
+        try:
+            await self.message.delete()
+        except discord.NotFound:
+            pass
 
-        if self.location:
-            embed.add_field(name="Ort / URL", value=self.location, inline=False)
+    def update_message(self, title):
+        """Queues an edit of the reminder message if the entry or the title changed since the last one"""
+        rendered = (self.event, title)
+        if rendered != self.last_rendered:
+            self.last_rendered = rendered
+            self.context.edits.edit(self.message, self.render_embed(title))
 
-        embed.add_field(name="Datum", value=self.event_start.strftime("%d.%m.%Y"), inline=False)
-        embed.add_field(name="Beginn", value=self.event_start.strftime("%H:%M"), inline=True)
+    def delete_reminder(self):
+        self.deleted = True
+        self.context.scheduler.cancel(self)
+        if self.message:
+            asyncio.create_task(self.delete_message())
+            self.context.storage.write('DELETE FROM reminders WHERE event_id = ?', (self.id,))
+        if self.context.reminders.get(self.id) is self:
+            del self.context.reminders[self.id]
 
-        if self.event_duration and self.event_end:
-            embed.add_field(name="Dauer", value=(str(self.event_duration)[:-3]), inline=True)
-            embed.add_field(name="Ende", value=self.event_end.strftime("%H:%M"), inline=True)
+    def update_reminder(self, event):
+        self.updated_stamp = event['updated']
+        self.event = EVENT_CACHE.get(event)
+        # the next refresh edits the message if it is running
+        self.context.scheduler.schedule(self, self.context.clock())
 
-        self.embed = embed
+    def title(self, now):
+        """Returns the title of the reminder message and the seconds until its countdown changes"""
+        text, seconds_until_change = countdown((self.event.event_start - now).total_seconds())
+        return f'**{self.event.calendar_name}**:  {self.event.summary} {text}', seconds_until_change
 
-    def set_embed_title(self):
-        seconds_until_event = (self.event_start - datetime.datetime.now(TIMEZONE)).total_seconds()
-        self.embed.title = f'**{self.calendar_name}**:  {self.summary} {format_seconds(seconds_until_event)}'
+    def render_embed(self, title):
+        embed = discord.Embed(title=title, description=self.event.description, colour=self.event.colour)
+        for name, value, inline in self.event.fields:
+            embed.add_field(name=name, value=value, inline=inline)
+        return embed
 
 
-def fetch_entries(limit=5, max_seconds_until_remind=300):
+def fetch_entries(limit=5, max_seconds_until_remind=300, service=None):
     """ Fetches upcoming calendar entries
 
     Parameters
     ----------
-    limit:  The maximum amount of calendar entries fetched per calendar
+    limit:      The maximum amount of calendar entries fetched per calendar
+    service:    A calendar service to reuse, a new one is built if omitted
 
     Returns
     -------
     A flattened list of calendar entries
     """
 
-    creds = None
-
-    if os.path.exists('data/google/token.pickle'):
-        with open('data/google/token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-
-    service = build('calendar', 'v3', credentials=creds)
+    if service is None:
+        service = build('calendar', 'v3', credentials=load_credentials())
 
     # Call the Calendar API
     now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
@@ -255,70 +634,492 @@ def fetch_entries(limit=5, max_seconds_until_remind=300):
     return events
 
 
+def load_credentials(tokenpath='data/google/token.pickle'):
+    """Loads the pickled google credentials created by data/google/googleauth.py"""
+    if os.path.exists(tokenpath):
+        with open(tokenpath, 'rb') as token:
+            return pickle.load(token)
+
+
+class DiscoveryCache(Cache):
+    """Keeps the discovery documents of the google APIs on disk, so building a
+    client does not have to download and parse them again after every restart"""
+
+    def __init__(self, path='data/google/discovery'):
+        self.path = path
+
+    def _file(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def get(self, url):
+        try:
+            with open(self._file(url), 'r') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(url), 'w') as file:
+            file.write(content)
+
+
+class CalendarClient:
+    """A long-lived Calendar API client.
+
+    The credentials are loaded and the service is built only once, the service keeps
+    its HTTP connection alive between requests. :meth:`refresh_credentials` refreshes
+    the credentials the same way data/google/googleauth.py does and should be called
+    before they expire.
+
+    Parameters
+    ----------
+    storage:        The :class:`core.storage.Storage` the credentials are kept in
+    tokenpath:      Path of the pickled google credentials, read if they are newer than the stored ones
+    api_endpoint:   Base URL of the Calendar API, can be pointed to a local fake server
+    discovery_url:  URL of the discovery document matching :api_endpoint:
+    """
+    refresh_margin = datetime.timedelta(minutes=5)
+
+    def __init__(self, storage, tokenpath='data/google/token.pickle', api_endpoint=None, discovery_url=None):
+        self.storage = storage
+        self.tokenpath = tokenpath
+        self.api_endpoint = api_endpoint
+        self.discovery_url = discovery_url
+
+        self.credentials = None
+        self._service = None
+        self._local = threading.local()
+
+    @property
+    def http(self):
+        """An authorized HTTP connection owned by the calling thread, httplib2 connections
+        must not be shared between threads"""
+        if not hasattr(self._local, 'http'):
+            self._local.http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return self._local.http
+
+    @property
+    def service(self):
+        if self._service is None:
+            if self.credentials is None:
+                self.load_credentials()
+            self._service = self.build_service()
+        return self._service
+
+    def build_service(self):
+        kwargs = {}
+        if self.api_endpoint:
+            kwargs['client_options'] = {'api_endpoint': self.api_endpoint}
+        if self.discovery_url:
+            kwargs['discoveryServiceUrl'] = self.discovery_url
+        return build('calendar', 'v3', http=self.http, cache=DiscoveryCache(), **kwargs)
+
+    def load_credentials(self):
+        """Loads the credentials from the storage, or from :tokenpath: if data/google/googleauth.py
+        wrote them after they were last stored"""
+        rows = self.storage.query("SELECT data, updated FROM tokens WHERE name = 'google'")
+        try:
+            pickle_modified = os.path.getmtime(self.tokenpath)
+        except OSError:
+            pickle_modified = None
+
+        if rows and (pickle_modified is None or rows[0][1] >= pickle_modified):
+            self.credentials = pickle.loads(rows[0][0])
+        else:
+            self.credentials = load_credentials(self.tokenpath)
+
+    def save_credentials(self):
+        """Queues the current credentials to be written to the storage, call it from the event loop"""
+        self.storage.write("INSERT OR REPLACE INTO tokens VALUES ('google', ?, ?)",
+                           (pickle.dumps(self.credentials), time.time()))
+
+    def credentials_expiring(self):
+        """Checks if the credentials expire within the next :refresh_margin:"""
+        if self.credentials is None or not self.credentials.refresh_token:
+            return False
+        if self.credentials.expiry is None:
+            return not self.credentials.valid
+        return self.credentials.expiry - self.refresh_margin <= datetime.datetime.utcnow()
+
+    def refresh_credentials(self):
+        self.credentials.refresh(Request())
+
+
+class CalendarSync:
+    """Keeps a local copy of all upcoming calendar entries up to date.
+
+    The first sync of every calendar fetches all upcoming entries, every following sync
+    only asks the Calendar API for the entries that changed since the last one by passing
+    the nextSyncToken of the previous response. The entries are kept in an
+    :class:`EventTimeline`, so the entries reminded of within the next :lookahead: are
+    found without going through all of them.
+
+    Parameters
+    ----------
+    client:         The :class:`CalendarClient` used to access the Calendar API
+    max_fetches:    The maximum number of calendars fetched at the same time
+    lookahead:      The timedelta within which entries are handed out as reminders
+    clock:          A function returning the current time
+    """
+
+    def __init__(self, client, max_fetches=8, lookahead=datetime.timedelta(days=7), clock=current_time):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_fetches, thread_name_prefix='calendar-fetch')
+        self.lookahead = lookahead
+        self.clock = clock
+
+        self.calendars = {}
+        self.calendar_list_token = None
+        self.sync_tokens = {}
+        self.events = {}
+        self.timeline = EventTimeline()
+        self.latencies = {}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def fetch_entries(self):
+        """Syncs all calendars and returns the entries reminded of within the lookahead window"""
+        self.sync()
+        return self.upcoming()
+
+    def sync(self):
+        service = self.client.service
+        self.sync_calendar_list(service)
+        for calendar_id in list(self.calendars):
+            self.timed_sync_events(service, calendar_id)
+
+    async def sync_concurrently(self):
+        """Syncs all calendars, fetching up to :max_fetches: calendars at the same time"""
+        loop = asyncio.get_running_loop()
+        service = await loop.run_in_executor(self.executor, lambda: self.client.service)
+        await loop.run_in_executor(self.executor, self.sync_calendar_list, service)
+        await asyncio.gather(*(loop.run_in_executor(self.executor, self.timed_sync_events, service, calendar_id)
+                               for calendar_id in list(self.calendars)))
+
+    def timed_sync_events(self, service, calendar_id):
+        """Syncs the events of a calendar and records how long that took, a failing
+        calendar keeps its last known events"""
+        start = time.perf_counter()
+        try:
+            self.sync_events(service, calendar_id)
+        except Exception:
+            logging.exception(f'fetching calendar "{calendar_id}" failed')
+        finally:
+            self.latencies[calendar_id] = time.perf_counter() - start
+
+    def sync_calendar_list(self, service):
+        try:
+            items, self.calendar_list_token = self.list_all(service.calendarList(), self.calendar_list_token)
+        except HttpError as error:
+            if error.resp.status != 410:
+                raise
+            # the sync token expired, start over with a full sync
+            logging.info('calendar list sync token expired, doing a full sync')
+            self.calendars.clear()
+            items, self.calendar_list_token = self.list_all(service.calendarList(), None)
+
+        for calendar_info in items:
+            if calendar_info.get('deleted'):
+                self.calendars.pop(calendar_info['id'], None)
+                self.sync_tokens.pop(calendar_info['id'], None)
+                for event_id in self.events.pop(calendar_info['id'], {}):
+                    self.timeline.remove(event_id)
+                self.latencies.pop(calendar_info['id'], None)
+            else:
+                self.calendars[calendar_info['id']] = calendar_info
+
+    def sync_events(self, service, calendar_id):
+        sync_token = self.sync_tokens.get(calendar_id)
+        try:
+            items, next_sync_token = self.list_all(service.events(), sync_token, calendarId=calendar_id)
+        except HttpError as error:
+            if error.resp.status != 410:
+                raise
+            logging.info(f'sync token of calendar "{calendar_id}" expired, doing a full sync')
+            sync_token = None
+            items, next_sync_token = self.list_all(service.events(), sync_token, calendarId=calendar_id)
+
+        if not sync_token:
+            # full sync, forget everything known about this calendar
+            for event_id in self.events.get(calendar_id, {}):
+                self.timeline.remove(event_id)
+            self.events[calendar_id] = {}
+        events = self.events[calendar_id]
+        self.sync_tokens[calendar_id] = next_sync_token
+
+        calendar_info = self.calendars.get(calendar_id, {})
+        for entry in items:
+            if entry.get('status') == 'cancelled':
+                events.pop(entry['id'], None)
+                self.timeline.remove(entry['id'])
+            else:
+                if 'backgroundColor' in calendar_info:
+                    entry['calendarColorId'] = calendar_info['backgroundColor']
+                events[entry['id']] = entry
+                self.timeline.add(calendar_id, entry)
+
+    def list_all(self, resource, sync_token, **kwargs):
+        """Pages through a list request and returns all items and the nextSyncToken.
+
+        A sync token keeps the time range of the full sync it started with, so the full sync
+        fetches all upcoming entries and the lookahead window is applied locally. All other
+        parameters have to be the same for the full and the incremental syncs, else the
+        changes of recurring entries arrive as their unexpanded master entry."""
+        if 'calendarId' in kwargs:
+            kwargs['singleEvents'] = True
+        if sync_token:
+            kwargs['syncToken'] = sync_token
+        elif 'calendarId' in kwargs:
+            kwargs['timeMin'] = self.clock().isoformat()
+
+        items = []
+        request = resource.list(**kwargs)
+        while request is not None:
+            response = request.execute(http=self.client.http)
+            items.extend(response.get('items', []))
+            request = resource.list_next(request, response)
+        return items, response.get('nextSyncToken')
+
+    def upcoming(self):
+        """Returns the entries reminded of within the lookahead window, ordered by their
+        reminder time, and forgets finished entries"""
+        now = self.clock()
+        for calendar_id, event_id in self.timeline.expire(now):
+            self.events.get(calendar_id, {}).pop(event_id, None)
+        return self.timeline.due(now + self.lookahead)
+
+
+class EventTimeline:
+    """The known calendar entries in the order they are reminded of.
+
+    The entries are kept in a list of (reminder time, event id) pairs sorted with
+    :mod:`bisect`, so the entries due until a point in time are a prefix of the list.
+    Entries are added from the fetch threads, the list is guarded by a lock.
+    """
+
+    def __init__(self):
+        self._order = []
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, calendar_id, entry):
+        """Adds :entry: or moves it to its new reminder time"""
+        key = (parse_remind_time(entry), entry['id'])
+        end = parse_time(entry, 'end') if 'end' in entry else parse_time(entry, 'start')
+        with self._lock:
+            self._remove(entry['id'])
+            bisect.insort(self._order, key)
+            self._entries[entry['id']] = (key, end, calendar_id, entry)
+
+    def remove(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id):
+        record = self._entries.pop(event_id, None)
+        if record:
+            del self._order[bisect.bisect_left(self._order, record[0])]
+
+    def due(self, until):
+        """Returns the entries reminded of until :until:, the earliest first"""
+        with self._lock:
+            entries = []
+            for remind_time, event_id in self._order:
+                if remind_time > until:
+                    break
+                entries.append(self._entries[event_id][3])
+            return entries
+
+    def expire(self, now):
+        """Removes the entries that ended before :now: and returns their (calendar id, event id)
+        pairs. An entry is reminded of before it ends, so only the due entries are checked."""
+        with self._lock:
+            expired = []
+            for remind_time, event_id in self._order:
+                if remind_time > now:
+                    break
+                key, end, calendar_id, entry = self._entries[event_id]
+                if end is None or end <= now:
+                    expired.append((calendar_id, event_id))
+
+            for calendar_id, event_id in expired:
+                self._remove(event_id)
+            return expired
+
+
+ParsedEvent = collections.namedtuple('ParsedEvent', ['updated', 'calendar_name', 'summary', 'event_start',
+                                                     'event_end', 'event_duration', 'reminder_start',
+                                                     'description', 'location', 'colour', 'fields'])
+
+
+def parse_event(event):
+    """Parses a calendar entry into a :class:`ParsedEvent`, including the fields of its embed"""
+    # mandatory
+    calendar_name = event["organizer"]["displayName"]
+    summary = event["summary"]
+    event_start = parse_time(event, 'start')
+
+    # optional
+    if 'end' in event:
+        event_end = parse_time(event, 'end')
+        event_duration = event_end - event_start
+    else:
+        event_end = None
+        event_duration = None
+
+    if 'description' in event:
+        description = html2text.html2text(event['description'])
+    else:
+        description = ''
+
+    location = event.get('location')
+
+    if 'calendarColorId' in event:
+        colour = discord.Colour(int(event['calendarColorId'].lstrip('#'), 16))
+    else:
+        colour = discord.Colour(0x000000)
+
+    fields = []
+    if location:
+        fields.append(("Ort / URL", location, False))
+
+    fields.append(("Datum", event_start.strftime("%d.%m.%Y"), False))
+    fields.append(("Beginn", event_start.strftime("%H:%M"), True))
+
+    if event_duration and event_end:
+        fields.append(("Dauer", str(event_duration)[:-3], True))
+        fields.append(("Ende", event_end.strftime("%H:%M"), True))
+
+    return ParsedEvent(parse_datetime(event['updated']), calendar_name, summary, event_start, event_end,
+                       event_duration, parse_remind_time(event), description, location, colour, tuple(fields))
+
+
+class EventCache:
+    """Remembers the :class:`ParsedEvent` of the :maxsize: most recently used calendar entries.
+
+    Entries are keyed by their id, 'updated' stamp and calendar colour, so an entry is only
+    parsed again after it changed."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, event):
+        key = (event['id'], event['updated'], event.get('calendarColorId'))
+        try:
+            parsed = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            parsed = self.entries[key] = parse_event(event)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return parsed
+
+
+EVENT_CACHE = EventCache()
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_datetime(string):
+    """Parses an RFC 3339 date or time string of the Calendar API into a datetime in TIMEZONE.
+    datetime.fromisoformat is a lot faster than dateutil, which is only used as a fallback."""
+    try:
+        parsed = datetime.datetime.fromisoformat(string.replace('Z', '+00:00'))
+    except ValueError:
+        parsed = dateutil.parser.parse(string)
+    return parsed.astimezone(TIMEZONE)
+
+
 def parse_time(event, event_time_key):
     """Helper function that gets the in :event_time_key: specified time string
     from the entry dict and returns it as an datetime object"""
 
     if 'dateTime' in event[event_time_key]:
-        return dateutil.parser.parse(event[event_time_key]['dateTime']).astimezone(TIMEZONE)
+        return parse_datetime(event[event_time_key]['dateTime'])
     elif 'date' in event[event_time_key]:
-        return dateutil.parser.parse(event[event_time_key]['date']).astimezone(TIMEZONE)
+        return parse_datetime(event[event_time_key]['date'])
     else:
         print("No date or dateTime key in entry dict recieved from Google Calendar API. Ignoring entry.")
 
 
 def format_seconds(seconds):
-    dayflag = False
-    hourflag = False
-
-    if seconds > 0:
-        output = 'in '
-    else:
+    """Returns the German countdown text for an event that is :seconds: away, negative
+    :seconds: are counted since the event started"""
+    future = seconds > 0
+    if not future:
         seconds *= -1
-        output = 'seit '
 
-    # Tage
     days = int(seconds / 86400)
-    if days >= 1:
-        dayflag = True
-        if days < 2:
-            output += 'einem Tag'
-        else:
-            output += f'{days} Tagen'
-        seconds -= days * 86400
-
-    # Stunden
+    seconds -= days * 86400
     hours = int(seconds / 3600)
-    if hours >= 1:
-        hourflag = True
-        if dayflag:
-            output += ' und '
-        if hours < 2:
-            output += 'einer Stunde'
-        else:
-            output += f'{hours} Stunden'
-        seconds -= hours * 3600
-    elif dayflag:
-        output += '.'
-        return output
+    seconds -= hours * 3600
+    # more than a day away the minutes are not shown
+    minutes = int(seconds / 60) if days < 1 else 0
 
-    if hourflag and dayflag:
-        return output
+    key = (future, days, hours, minutes)
+    text = COUNTDOWN_TEXTS.get(key)
+    if text is None:
+        text = COUNTDOWN_TEXTS[key] = countdown_text(*key)
+    return text
 
-    else:
+
+def countdown(seconds):
+    """Returns the countdown text of :func:`format_seconds` and the seconds until it changes"""
+    return format_seconds(seconds), countdown_change(seconds)
+
+
+def countdown_text(future, days, hours, minutes):
+    """Builds the countdown text of :func:`format_seconds`, every text is only built once
+    and kept in :data:`COUNTDOWN_TEXTS`"""
+    output = 'in ' if future else 'seit '
+
+    if days >= 1:
+        output += 'einem Tag' if days < 2 else f'{days} Tagen'
+        if hours < 1:
+            return output + '.'
         output += ' und '
-    # Minuten
-    minutes = int(seconds / 60)
+
+    if hours >= 1:
+        output += 'einer Stunde' if hours < 2 else f'{hours} Stunden'
+        if days >= 1:
+            return output
+
+    output += ' und '
     if minutes >= 2:
         output += f'{minutes} Minuten.'
     elif minutes >= 1:
         output += 'einer Minute.'
     else:
         output += 'weniger als einer Minute.'
-
     return output
 
 
+# countdown texts by (future, days, hours, minutes), the minutes are 0 for more than a day
+COUNTDOWN_TEXTS = {}
+
+
+def countdown_change(seconds):
+    """Returns the seconds until :func:`format_seconds` returns a different string for a
+    countdown that is :seconds: away, counting down."""
+    if seconds > 0:
+        # more than a day away the countdown shows hours, else minutes
+        unit = 3600 if seconds >= 86400 else 60
+        return seconds % unit
+    else:
+        unit = 3600 if -seconds >= 86400 else 60
+        return unit - (-seconds % unit)
+
+
 def parse_remind_time(event):
     if 'reminders' in event and 'overrides' in event['reminders']:
         remind_minutes = event['reminders']['overrides'][0]['minutes']
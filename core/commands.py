@@ -5,17 +5,17 @@ import typing
 from discord.ext import commands
 
 from core.setup import setup_dialog
-from core.utils import is_admin, get_member, send_more
+from core.utils import is_admin, get_member, send_more, set_roles
 
 
 async def toggle_role(member, role):
     """Gives/removes the specified role to/from the specified member"""
     if role in member.roles:
-        await member.remove_roles(role)
-        await member.send(f'Du hast die Rolle **{role.name}** erhalten!')
-    else:
-        await member.add_roles(role)
+        await set_roles(member, remove_ids={role.id})
         await member.send(f'Deine Rolle **{role.name}** wurde entfernt!')
+    else:
+        await set_roles(member, add=[role])
+        await member.send(f'Du hast die Rolle **{role.name}** erhalten!')
 
 
 class Commands(commands.Cog):
@@ -34,10 +34,28 @@ class Commands(commands.Cog):
     async def clean(self, context):
         """Deletes up to 10k unpinned messages in this channel"""
         await context.channel.send('Möchtest du wirklich alle Nachrichten in diesem Channel löschen?')
-        message = await self.bot.userinput(context.channel, context.author)
-        if message.content.lower() in ['ja', 'yes', 'y']:
+        try:
+            answer = await self.bot.userinput(context.channel, context.author, timeout=60)
+        except asyncio.TimeoutError:
+            return
+        if answer.lower() in ['ja', 'yes', 'y']:
             await context.channel.purge(check=lambda msg: not msg.pinned, limit=10000)
 
+    @is_admin()
+    @commands.command()
+    async def reload(self, context):
+        """Reloads the config file without restarting the bot"""
+        if await self.bot.reload_config():
+            await context.channel.send('_Config reloaded._')
+        else:
+            await context.channel.send('_The config file is invalid, the current config is kept._')
+
+    @is_admin()
+    @commands.command()
+    async def stats(self, context):
+        """Zeigt die Metriken des Bots an"""
+        await send_more(context.channel, self.bot.metrics.summary() or 'Es wurden noch keine Metriken erfasst.')
+
     @is_admin()
     @commands.command()
     async def clear(self, context, amount: int):
@@ -54,7 +72,11 @@ class Commands(commands.Cog):
     async def setup(self, context):
         """Startet den Setup-Dialog"""
         member = get_member(self.bot, context.author)
-        await setup_dialog(self.bot, member)
+        try:
+            await setup_dialog(self.bot, member)
+        except discord.HTTPException:
+            await context.send('Ich kann dir keine Direktnachricht schicken! '
+                               'Bitte erlaube Direktnachrichten von Servermitgliedern.')
 
     @commands.command()
     async def admin(self, context):
@@ -79,25 +101,24 @@ class Commands(commands.Cog):
     async def broadcast(self, context, roles: commands.Greedy[discord.Role],
                         channel: typing.Optional[discord.TextChannel] = None,
                         command=None):
-
-        commands = {"setup": setup_dialog}
-
-        receiver = []
-        if roles:
-            for role in roles:
-                if role in context.guild.roles:
-                    for member in role.members:
-                        receiver.append(member)
-        else:
-            context.send('Es muss eine Rolle angegeben werden!')
-
-        if command in commands:
-            for member in receiver:
-                try:
-                    asyncio.create_task(commands[command](self.bot, member))
-                except (AttributeError, discord.HTTPException):
-                    print('Kein DM-Channel - Vermutlich ein Bot')
-
-
-
-
+        """Führt einen Befehl für alle Mitglieder der angegebenen Rollen aus"""
+        if not roles:
+            await context.send('Es muss eine Rolle angegeben werden!')
+            return
+
+        broadcaster = self.bot.broadcaster
+        if command not in broadcaster.actions:
+            await context.send(f'Unbekannter Befehl! Möglich sind: {", ".join(broadcaster.actions)}')
+            return
+
+        # members with several of the roles only receive the broadcast once
+        receiver = {}
+        for role in roles:
+            if role in context.guild.roles:
+                for member in role.members:
+                    if not member.bot:
+                        receiver[member.id] = member
+
+        job = broadcaster.create(command, receiver.values(), context.channel)
+        await context.send(f'Broadcast "{command}" an {len(receiver)} Mitglieder gestartet.')
+        broadcaster.start(job)
@@ -1,6 +1,7 @@
 import logging
 
-from schema import Schema, SchemaError
+import yaml
+from schema import Schema, SchemaError, Optional
 
 
 schema = Schema({
@@ -21,8 +22,7 @@ schema = Schema({
         },
 
         'channels': {
-            'admin_calendar': int,
-            'hm_feed': int
+            'admin_calendar': int
         },
 
         'semesters': {
@@ -33,6 +33,22 @@ schema = Schema({
                 }
             }
         }
+    },
+
+    Optional('feeds'): [{
+        'name': str,
+        'url': str,
+        'channel': int,
+        Optional('interval'): int
+    }],
+
+    Optional('calendar'): {
+        Optional('lookahead_days'): int
+    },
+
+    Optional('metrics'): {
+        Optional('host'): str,
+        Optional('port'): int
     }
 })
 
@@ -43,3 +59,9 @@ def validate(config):
         return schema.validate(config)
     except SchemaError as e:
         logging.warning('The configuration file seems to be invalid:\n' + str(e))
+
+
+def load(path):
+    """Loads and validates the configuration file at :path:"""
+    with open(path, 'r') as file:
+        return validate(yaml.load(file, Loader=yaml.Loader))
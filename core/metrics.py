@@ -0,0 +1,234 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import math
+import time
+
+import discord
+
+
+class Metric:
+    """A named value per combination of label values
+
+    Parameters
+    ----------
+    name:       The name the metric is exported under
+    help:       A short description of the metric
+    labels:     The names of the labels the values are split by
+    """
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def update(self):
+        pass
+
+    def samples(self):
+        """Returns (name suffix, (label name, label value) pairs, value) tuples of all values"""
+        return [('', tuple(zip(self.labels, labels)), value) for labels, value in sorted(self.values.items())]
+
+    def summary(self, labels):
+        return format_value(self.values[labels])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down. If :collect: is given it is called when the gauge is
+    read and returns a dict of label values and values, so the gauge is always current."""
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def update(self):
+        if self.collect is not None:
+            self.values = dict(self.collect())
+
+
+class Histogram(Metric):
+    """Counts the observed values in buckets of upper bounds, like a Prometheus histogram"""
+    type = 'histogram'
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # bucket counts, sum, count and maximum of the label values
+        values = self.values.get(labels)
+        if values is None:
+            values = self.values[labels] = [[0] * len(self.buckets), 0, 0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            values[0][index] += 1
+        values[1] += value
+        values[2] += 1
+        values[3] = max(values[3], value)
+
+    def samples(self):
+        samples = []
+        for labels, (counts, total, count, maximum) in sorted(self.values.items()):
+            pairs = tuple(zip(self.labels, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', pairs + (('le', format_value(bound)),), cumulative))
+            samples.append(('_bucket', pairs + (('le', '+Inf'),), count))
+            samples.append(('_sum', pairs, total))
+            samples.append(('_count', pairs, count))
+        return samples
+
+    def summary(self, labels):
+        counts, total, count, maximum = self.values[labels]
+        return f'{count}x, ⌀ {total / count * 1000:.0f} ms, max {maximum * 1000:.0f} ms'
+
+
+class Metrics:
+    """The metrics of the bot, exported in the Prometheus text format by :meth:`render`"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        """Adds :metric:, a metric registered again under the same name replaces the old one"""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=Histogram.default_buckets):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            metric.update()
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, pairs, value in metric.samples():
+                if pairs:
+                    text = ','.join(f'{name}="{escape(label)}"' for name, label in pairs)
+                    lines.append(f'{metric.name}{suffix}{{{text}}} {format_value(value)}')
+                else:
+                    lines.append(f'{metric.name}{suffix} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Returns the current values in a form readable in discord"""
+        output = ''
+        for metric in self.metrics.values():
+            metric.update()
+            for labels in sorted(metric.values):
+                name = ' '.join((metric.name,) + tuple(str(label) for label in labels))
+                output += f'{name}: {metric.summary(labels)}\n'
+        return output
+
+
+def format_value(value):
+    """Formats a value without losing precision, counters must not be rounded"""
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# the route of the discord request the current task is waiting for
+current_route = contextvars.ContextVar('current_route', default=('', ''))
+
+
+def instrument_http(http, metrics):
+    """Wraps the request method of a discord HTTPClient to record the latency and the
+    status of every request per route"""
+    latency = metrics.histogram('uf3bot_discord_request_seconds', 'Latency of discord REST requests',
+                                ('method', 'route'))
+    errors = metrics.counter('uf3bot_discord_request_errors_total', 'Failed discord REST requests',
+                             ('method', 'route', 'status'))
+    rate_limits = metrics.counter('uf3bot_discord_rate_limits_total', 'Requests that hit a rate limit',
+                                  ('method', 'route'))
+
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        # the unformatted path, so requests to different channels share a route
+        labels = (route.method, route.path)
+        current_route.set(labels)
+        start = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except discord.HTTPException as error:
+            errors.inc(*labels, str(error.status))
+            raise
+        finally:
+            latency.observe(time.perf_counter() - start, *labels)
+
+    http.request = timed_request
+    logging.getLogger('discord.http').addHandler(RateLimitHandler(rate_limits))
+
+
+class RateLimitHandler(logging.Handler):
+    """Counts the rate limit warnings discord.py logs while it waits out a 429 response"""
+
+    def __init__(self, counter):
+        super().__init__(logging.WARNING)
+        self.counter = counter
+
+    def emit(self, record):
+        if 'rate limit' in str(record.msg):
+            self.counter.inc(*current_route.get())
+
+
+async def monitor_loop_lag(metrics, interval=1):
+    """Measures how much later than requested the event loop wakes up a sleeping task"""
+    lag = metrics.histogram('uf3bot_event_loop_lag_seconds', 'Delay of the event loop')
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag.observe(max(loop.time() - start - interval, 0))
+
+
+async def serve(metrics, host, port):
+    """Serves the metrics in the Prometheus text format, every request gets the same answer"""
+
+    async def handle(reader, writer):
+        try:
+            # read the request up to the empty line, its content does not matter
+            while (await reader.readline()).strip():
+                pass
+            body = metrics.render().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,4 +1,6 @@
 class Semester:
+    __slots__ = ('year', 'channel', 'groups')
+
     def __init__(self, year, channel=None, groups=None):
         self.year = year
         self.channel = channel
@@ -15,6 +17,8 @@ class Semester:
 
 
 class StudyGroup:
+    __slots__ = ('name', 'semester', 'role')
+
     def __init__(self, name, role, semester):
         self.name = name
         self.semester = semester
@@ -1,91 +1,355 @@
 import asyncio
+import functools
+import hashlib
+import heapq
+import itertools
+import logging
+import random
+import time
 
 import discord
 import feedparser
 import pickle
 
-from discord.ext import tasks, commands
-from core.utils import is_admin
+from discord.ext import commands
+from core.utils import is_admin, send_more
 
 
-class HMFeed(commands.Cog):
-    refresh_interval = 30
+class FeedError(Exception):
+    pass
 
-    def __init__(self, eit):
-        self.entries = []
-        self.picklepath = eit.bot.datapath / 'hmfeed.pickle'
-        self.url = eit.hm_feed_url
-        self.channel = eit.hm_feed_channel
 
-        self.load()
-        self.refresh.start()
+class FeedManager(commands.Cog):
+    """Polls all feeds configured in config.yml and sends new entries to their channels.
 
-    @commands.command(usage='!feed <amount>')
+    Every feed is refreshed by its own task on its own interval. A random jitter keeps the
+    feeds from being fetched in lockstep and a failing feed backs off exponentially. At most
+    :max_concurrent_fetches: feeds are fetched at the same time.
+    """
+    max_concurrent_fetches = 4
+    default_interval = 30
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(self.max_concurrent_fetches)
+        self.edit_queue = EditQueue()
+        self.feeds = {}
+        self.fetch_time = bot.metrics.histogram('uf3bot_feed_fetch_seconds',
+                                                'Duration of downloading and parsing a feed', ('feed',))
+
+        for feed_config in bot.config.get('feeds', []):
+            self.add_feed(feed_config)
+
+    def add_feed(self, feed_config):
+        channel = self.bot.get_channel(feed_config['channel'])
+        if channel is None:
+            logging.warning(f'channel of feed "{feed_config["name"]}" not found')
+            return
+
+        feed = Feed(feed_config['name'], feed_config['url'], channel,
+                    SeenStore(self.bot.storage, feed_config['name']),
+                    self.edit_queue, feed_config.get('interval', self.default_interval), self.fetch_time)
+
+        # the HM feed used to be saved in a pickle file
+        if feed.name == 'hm':
+            feed.seen.migrate(self.bot.datapath / 'hmfeed.pickle')
+
+        self.feeds[feed.name] = feed
+        feed.start(self.semaphore)
+
+    def cog_unload(self):
+        for feed in self.feeds.values():
+            feed.stop()
+        self.edit_queue.stop()
+
+    @commands.Cog.listener()
+    async def on_config_reload(self, old_config):
+        """Starts new feeds and stops removed ones, unchanged feeds keep running"""
+        old_feeds = {feed_config['name']: feed_config for feed_config in old_config.get('feeds', [])}
+        new_feeds = {feed_config['name']: feed_config for feed_config in self.bot.config.get('feeds', [])}
+
+        for name, feed_config in old_feeds.items():
+            if new_feeds.get(name) != feed_config and name in self.feeds:
+                self.feeds.pop(name).stop()
+
+        for name, feed_config in new_feeds.items():
+            if name not in self.feeds:
+                self.add_feed(feed_config)
+
+    @commands.command()
+    @is_admin()
+    async def feeds(self, context):
+        """Zeigt den Status aller Feeds an"""
+        output = ''
+        for feed in self.feeds.values():
+            output += f'{feed.name}: alle {feed.interval}s -> #{feed.channel}, {feed.failures} Fehler in Folge\n'
+        queue = self.edit_queue
+        output += (f'\nEmbed-Warteschlange: {queue.depth} ausstehend, {queue.retries} Wiederholungen, '
+                   f'{queue.fallbacks} lokal erstellt, {queue.failures} fehlgeschlagen')
+        await send_more(context.channel, output)
+
+    @commands.command(usage='!feed <amount> [feed]')
     @is_admin()
-    async def feed(self, context, amount: int):
+    async def feed(self, context, amount: int, name=None):
         """Sendet die angebende Anzahl an Feed-Einträgen"""
+        if name is None and self.feeds:
+            name = next(iter(self.feeds))
+        if name not in self.feeds:
+            await context.channel.send(f'Es gibt keinen Feed mit dem Namen "{name}"!')
+            return
+        feed = self.feeds[name]
+
         if amount > 20:
             amount = 20
         elif amount < 1:
             amount = 1
 
-        new_feed = feedparser.parse(self.url)
-        for entry in new_feed["entries"]:
-            if amount <= 0:
-                return
-            await self.send_entry(entry)
-            amount -= 1
+        try:
+            new_feed = await feed.fetch(conditional=False)
+        except FeedError as error:
+            await context.channel.send(f'Der Feed konnte nicht abgerufen werden: {error}')
+            return
 
-    @tasks.loop(seconds=refresh_interval)
-    async def refresh(self):
-        new_feed = feedparser.parse(self.url)
-        new_entries = []
-        for entry in new_feed["entries"]:
-            new_entries.append(entry)
+        for entry in new_feed["entries"][:amount]:
+            await feed.send_entry(entry)
 
-        new_entries.reverse()
 
-        if new_entries == self.entries:
-            return
-        else:
-            await self.compare_feeds(new_entries)
-            self.save()
+class Feed:
+    """A single feed and the channel its new entries are sent to
 
-    def load(self):
-        try:
-            with self.picklepath.open('rb') as file:
-                self.entries = pickle.load(file)
-        except EOFError:
-            pass
-        except FileNotFoundError:
-            pass
+    Parameters
+    ----------
+    name:       The name of the feed in config.yml
+    url:        URL of the RSS/Atom feed
+    channel:    The channel new entries are sent to
+    seen:       The :class:`SeenStore` of this feed
+    edit_queue: The :class:`EditQueue` embeds of sent entries are completed in
+    interval:   Seconds between two refreshes
+    fetch_time: The histogram the duration of every fetch is recorded in
+    """
+    jitter = 0.1
+    max_backoff = 3600
+
+    def __init__(self, name, url, channel, seen, edit_queue, interval, fetch_time):
+        self.name = name
+        self.url = url
+        self.channel = channel
+        self.seen = seen
+        self.edit_queue = edit_queue
+        self.interval = interval
+        self.fetch_time = fetch_time
+
+        self.failures = 0
+        self.task = None
+
+        # validators of the last response, used for conditional requests
+        self.etag = None
+        self.modified = None
+
+    def start(self, semaphore):
+        self.task = asyncio.create_task(self.run(semaphore))
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def next_delay(self):
+        """Returns the seconds until the next refresh, backing off after failed refreshes"""
+        delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run(self, semaphore):
+        while True:
+            try:
+                async with semaphore:
+                    new_feed = await self.fetch()
+                self.failures = 0
+                if new_feed is not None:
+                    await self.compare_feeds(list(reversed(new_feed["entries"])))
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.failures += 1
+                logging.warning(f'refreshing feed "{self.name}" failed ({self.failures} times in a row): {error}')
+
+            await asyncio.sleep(self.next_delay())
+
+    async def fetch(self, conditional=True):
+        """Downloads and parses the feed in an executor, so the event loop is not blocked.
+
+        If :conditional: is set, the ETag and Last-Modified values of the last response are sent
+        along and None is returned if the feed has not changed since then."""
+        kwargs = {}
+        if conditional:
+            kwargs = {'etag': self.etag, 'modified': self.modified}
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        new_feed = await loop.run_in_executor(None, functools.partial(feedparser.parse, self.url, **kwargs))
+        self.fetch_time.observe(time.perf_counter() - start, self.name)
+
+        # feedparser does not parse the body of a 304 response
+        if conditional and new_feed.get('status') == 304:
+            return None
+
+        if new_feed.get('bozo') and not new_feed.get('entries'):
+            raise FeedError(str(new_feed.get('bozo_exception')))
 
-    def save(self):
-        with self.picklepath.open('wb') as file:
-            pickle.dump(self.entries, file)
+        if conditional:
+            self.etag = new_feed.get('etag')
+            self.modified = new_feed.get('modified')
+
+        return new_feed
 
     async def compare_feeds(self, new_entries):
-        for entry in new_entries:
-            if entry not in self.entries:
-                await self.send_entry(entry)
-        self.entries = new_entries
+        new = [entry for entry in new_entries if self.seen.is_new(entry)]
+        for entry in new:
+            await self.send_entry(entry)
+        self.seen.add(new)
 
     async def send_entry(self, entry):
         message = await self.channel.send(entry['link'])
-        await self.create_edit_task(message, entry)
+        self.edit_queue.put(message, entry)
+
+
+class EditQueue:
+    """Completes the embeds of sent feed entries.
+
+    Discord unfurls the link of a sent entry some time after the message was sent, so
+    the embed is edited with a delay. Failed edits are retried with an exponential backoff,
+    after :max_attempts: attempts the embed is built locally from the entry instead.
+    """
+    base_delay = 2
+    max_attempts = 5
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._changed = asyncio.Event()
+        self._task = None
+
+        self.retries = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    @property
+    def depth(self):
+        """The number of edits waiting in the queue"""
+        return len(self._heap)
+
+    def put(self, message, entry, attempt=0):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
 
-    async def create_edit_task(self, message, entry):
-        asyncio.create_task(self.edit_embed(message, entry))
+        due = time.monotonic() + self.base_delay * 2 ** attempt
+        heapq.heappush(self._heap, (due, next(self._counter), message, entry, attempt))
+        self._changed.set()
 
-    async def edit_embed(self, message, entry):
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            while self._heap and self._heap[0][0] <= time.monotonic():
+                due, _, message, entry, attempt = heapq.heappop(self._heap)
+                await self.edit(message, entry, attempt)
+
+            timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def edit(self, message, entry, attempt):
         try:
-            new_embed = message.embeds[0]
-            new_embed.description = entry['summary']
-            published = entry['published_parsed']
-            text = f'Veröffentlicht am {published.tm_mday}.{published.tm_mon}.{published.tm_year}'
-            new_embed.set_footer(text=text)
+            if attempt + 1 < self.max_attempts:
+                # the message returned by send is never updated with the embed discord unfurls
+                message = await message.channel.fetch_message(message.id)
+                new_embed = message.embeds[0]
+            else:
+                self.fallbacks += 1
+                new_embed = discord.Embed(title=entry.get('title'), url=entry.get('link'))
+
+            new_embed.description = entry.get('summary')
+            published = entry.get('published_parsed')
+            if published:
+                text = f'Veröffentlicht am {published.tm_mday}.{published.tm_mon}.{published.tm_year}'
+                new_embed.set_footer(text=text)
             await message.edit(content=None, embed=new_embed)
-            return
 
+        except discord.NotFound:
+            self.failures += 1
         except (discord.HTTPException, IndexError):
-            await self.create_edit_task(message, entry)
+            if attempt + 1 < self.max_attempts:
+                self.retries += 1
+                self.put(message, entry, attempt + 1)
+            else:
+                self.failures += 1
+                logging.warning(f'could not edit the embed of feed entry "{entry.get("link")}"')
+
+
+def entry_key(entry):
+    """Returns the key a feed entry is identified by"""
+    return entry.get('id') or entry.get('link')
+
+
+def entry_hash(entry):
+    """Returns a hash of the content of a feed entry"""
+    content = '\0'.join(str(entry.get(key, '')) for key in ('title', 'link', 'summary'))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+class SeenStore:
+    """Remembers which entries of a feed were already sent.
+
+    Every entry is stored with the hash of its content, so a changed entry counts as new
+    again. The entries are kept in memory for lookups and written to the storage of the bot,
+    only the :retention: most recently seen entries are kept.
+    """
+
+    def __init__(self, storage, feed, retention=1000):
+        self.storage = storage
+        self.feed = feed
+        self.retention = retention
+        self.hashes = dict(storage.query('SELECT key, hash FROM feed_seen WHERE feed = ? ORDER BY seen_at',
+                                         (feed,)))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def is_new(self, entry):
+        return self.hashes.get(entry_key(entry)) != entry_hash(entry)
+
+    def add(self, entries):
+        if not entries:
+            return
+
+        for entry in entries:
+            key, digest = entry_key(entry), entry_hash(entry)
+            self.storage.write('INSERT OR REPLACE INTO feed_seen VALUES (?, ?, ?, ?)', (self.feed, key, digest, time.time()))
+
+            # keep the dict ordered from the least to the most recently seen entry
+            self.hashes.pop(key, None)
+            self.hashes[key] = digest
+
+        self.storage.write('DELETE FROM feed_seen WHERE feed = ? AND key NOT IN '
+                           '(SELECT key FROM feed_seen WHERE feed = ? ORDER BY seen_at DESC LIMIT ?)',
+                           (self.feed, self.feed, self.retention))
+        while len(self.hashes) > self.retention:
+            del self.hashes[next(iter(self.hashes))]
+
+    def migrate(self, picklepath):
+        """Imports the entries of the pickle file the feed used to be saved in and removes it"""
+        try:
+            with picklepath.open('rb') as file:
+                entries = pickle.load(file)
+        except (EOFError, FileNotFoundError):
+            return
+
+        self.add(entries)
+        picklepath.unlink()
+        logging.info(f'migrated {len(entries)} feed entries from "{picklepath}"')
@@ -1,8 +1,20 @@
 import logging
+import time
 
 import discord
 
 from core import embeds
+from core.utils import set_roles
+
+
+# states of the setup dialog
+START = 'start'
+AWAITING_NAME = 'awaiting_name'
+AWAITING_GROUP = 'awaiting_group'
+APPLYING_ROLES = 'applying_roles'
+
+# seconds after which an unanswered setup dialog is forgotten
+DIALOG_EXPIRY = 7 * 24 * 3600
 
 
 def is_valid(name):
@@ -14,49 +26,152 @@ def is_valid(name):
 
 
 async def setup_dialog(bot, member):
-    try:
-        await member.send(embed=embeds.setup_start)
-    except (AttributeError, discord.HTTPException):
-        pass
-
-    # loop until User tiped in a valid name
-    while True:
-        name = await bot.userinput(member.dm_channel, member)
-        if is_valid(name):
-            break
-        else:
+    """Starts the setup dialog with :member:, raises discord.HTTPException if the member
+    can not receive direct messages"""
+    await bot.setup_dialogs.start(member)
+
+
+class SetupStore:
+    """Keeps the state of all open setup dialogs in memory and in the storage of the bot"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.dialogs = {row[0]: row[1:] for row in storage.query('SELECT * FROM setup')}
+
+    def __len__(self):
+        return len(self.dialogs)
+
+    def __contains__(self, member_id):
+        return member_id in self.dialogs
+
+    def get(self, member_id):
+        """Returns the (state, name, group name, updated) tuple of a dialog"""
+        return self.dialogs.get(member_id)
+
+    def put(self, member_id, state, name=None, group_name=None, updated=None):
+        """Stores the state of a dialog, :updated: is the time of the last answer of the member"""
+        row = (state, name, group_name, time.time() if updated is None else updated)
+        self.dialogs[member_id] = row
+        self.storage.write('INSERT OR REPLACE INTO setup VALUES (?, ?, ?, ?, ?)', (member_id, *row))
+
+    def delete(self, member_id):
+        if self.dialogs.pop(member_id, None):
+            self.storage.write('DELETE FROM setup WHERE member_id = ?', (member_id,))
+
+
+class SetupDialogs:
+    """The setup dialog as a state machine.
+
+    A dialog moves from START over AWAITING_NAME and AWAITING_GROUP to APPLYING_ROLES. Every
+    answer of a member advances its dialog by one step, no coroutine is kept waiting for
+    answers. The states are persisted, so open dialogs survive a restart and are resumed
+    by :meth:`resume`.
+    """
+
+    def __init__(self, bot, store):
+        self.bot = bot
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    async def start(self, member):
+        self.store.put(member.id, START)
+        try:
+            await member.send(embed=embeds.setup_start)
+        except discord.HTTPException:
+            # nobody is waiting for an answer the member never got
+            self.store.delete(member.id)
+            raise
+        self.store.put(member.id, AWAITING_NAME)
+
+    async def resume(self):
+        """Continues all dialogs that were open when the bot stopped.
+
+        The prompts are sent again through the token bucket of the broadcaster, so a restart
+        does not send a burst of direct messages. A resumed dialog keeps the time of the last
+        answer, so abandoned dialogs still expire after :data:`DIALOG_EXPIRY`. A dialog that
+        advanced while its prompt waited for the bucket is left alone."""
+        for member_id in list(self.store.dialogs):
+            dialog = self.store.get(member_id)
+            if dialog is None:
+                continue
+            state, name, group_name, updated = dialog
+            member = self.bot.get_member(member_id)
+            if member is None or time.time() - updated > DIALOG_EXPIRY:
+                self.store.delete(member_id)
+                continue
+
+            await self.bot.broadcaster.bucket.acquire()
+            # the member may have answered or finished the dialog while waiting for the bucket
+            if self.store.get(member_id) != dialog:
+                continue
+            try:
+                if state in (START, AWAITING_NAME):
+                    await member.send(embed=embeds.setup_start)
+                    if state == START:
+                        self.store.put(member.id, AWAITING_NAME, updated=updated)
+                elif state == AWAITING_GROUP:
+                    await member.send(embed=embeds.setup_group_select(name, self.bot.semesters))
+                elif state == APPLYING_ROLES:
+                    await self.apply_roles(member, group_name)
+            except discord.HTTPException:
+                logging.info(f'could not resume setup dialog of member "{member.name}"')
+
+    async def handle(self, message):
+        """Advances the dialog of the author of a direct message"""
+        dialog = self.store.get(message.author.id)
+        if dialog is None or message.content.startswith(self.bot.command_prefix):
+            return
+
+        state, name, group_name, updated = dialog
+        if time.time() - updated > DIALOG_EXPIRY:
+            self.store.delete(message.author.id)
+            return
+
+        member = self.bot.get_member(message.author.id)
+        if member is None:
+            self.store.delete(message.author.id)
+        elif state == AWAITING_NAME:
+            await self.handle_name(member, message.content)
+        elif state == AWAITING_GROUP:
+            await self.handle_group(member, name, message.content)
+
+    async def handle_name(self, member, name):
+        if not is_valid(name):
             await member.send(embed=embeds.setup_name_error)
+            return
+
+        self.store.put(member.id, AWAITING_GROUP, name)
 
-    # change Users Nickname to tiped name
-    try:
-        await member.edit(nick=name)
-    except discord.Forbidden:
-        logging.info(f'could not asign new nickname to member "{member.name}"')
-
-    await member.send(embed=embeds.setup_group_select(name, bot.semesters))
-
-    # loop until User tiped in a valid studygroup
-    flag = True
-    roles_to_add = [bot.roles['student']]
-    while flag:
-        message = await bot.userinput(member.dm_channel, member)
-        if message.upper() == 'GAST':
-            roles_to_add.append(bot.roles['gast'])
-            await member.send(embed=embeds.setup_end("Gast"))
-            break
-
-        for group in bot.study_groups:
-            if message.upper() == group.name:
-                roles_to_add.append(group.role)
-                await member.send(embed=embeds.setup_end(group.name))
-                flag = False
-                break
+        # change Users Nickname to tiped name
+        try:
+            await member.edit(nick=name)
+        except discord.Forbidden:
+            logging.info(f'could not asign new nickname to member "{member.name}"')
+
+        await member.send(embed=embeds.setup_group_select(name, self.bot.semesters))
+
+    async def handle_group(self, member, name, answer):
+        if answer.upper() == 'GAST':
+            group_name = 'Gast'
+        elif answer.upper() in self.bot.groups_by_name:
+            group_name = self.bot.groups_by_name[answer.upper()].name
         else:
-            await member.send(embed=embeds.setup_group_error(message))
+            await member.send(embed=embeds.setup_group_error(answer))
+            return
+
+        self.store.put(member.id, APPLYING_ROLES, name, group_name)
+        await member.send(embed=embeds.setup_end(group_name))
+        await self.apply_roles(member, group_name)
 
-    # Check if User already has studygroup roles, if so, remove them
-    for role in member.roles:
-        if role == bot.roles['gast'] or role in [group.role for group in bot.study_groups]:
-            await member.remove_roles(role)
+    async def apply_roles(self, member, group_name):
+        roles_to_add = [self.bot.roles['student']]
+        if group_name == 'Gast':
+            roles_to_add.append(self.bot.roles['gast'])
+        elif group_name.upper() in self.bot.groups_by_name:
+            roles_to_add.append(self.bot.groups_by_name[group_name.upper()].role)
 
-    await member.add_roles(*roles_to_add)
+        # replace the studygroup roles the User already has
+        await set_roles(member, add=roles_to_add, remove_ids=self.bot.group_role_ids | {self.bot.roles['gast'].id})
+        self.store.delete(member.id)
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS feed_seen (feed TEXT NOT NULL, key TEXT NOT NULL, hash TEXT NOT NULL,
+                                      seen_at REAL NOT NULL, PRIMARY KEY (feed, key));
+CREATE TABLE IF NOT EXISTS reminders (event_id TEXT PRIMARY KEY, channel_id INTEGER NOT NULL,
+                                      message_id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS setup (member_id INTEGER PRIMARY KEY, state TEXT NOT NULL, name TEXT,
+                                  group_name TEXT, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS tokens (name TEXT PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL);
+'''
+
+
+class Storage:
+    """The SQLite database all persistent state of the bot is kept in.
+
+    The database is only accessed from a single executor thread, so the event loop never
+    waits for the disk. Writes are collected for :flush_delay: seconds and committed together
+    in one transaction, the database runs in WAL mode so a crash never leaves a half written
+    file behind.
+
+    :meth:`write` must be called from the event loop, :meth:`query` blocks until the result
+    is available and is meant for loading state at startup.
+    """
+    flush_delay = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        self.connection = None
+        self.pending = []
+        self.flush_handle = None
+
+        self.executor.submit(self._connect).result()
+
+    def _connect(self):
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def _fetch(self, sql, params):
+        return self.connection.execute(sql, params).fetchall()
+
+    def _commit(self, batch):
+        with self.connection:
+            for sql, params in batch:
+                self.connection.execute(sql, params)
+
+    def query(self, sql, params=()):
+        return self.executor.submit(self._fetch, sql, params).result()
+
+    async def fetch(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._fetch, sql, params)
+
+    def write(self, sql, params=()):
+        """Queues a write, it is committed with all other writes of the next :flush_delay: seconds"""
+        self.pending.append((sql, params))
+        if self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.create_task(self.flush()))
+
+    async def flush(self):
+        """Commits all queued writes in one transaction"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self.executor, self._commit, batch)
+            except sqlite3.Error:
+                logging.exception(f'could not commit {len(batch)} writes to "{self.path}"')
+
+    def close(self):
+        """Commits the queued writes and closes the database"""
+        batch, self.pending = self.pending, []
+        self.executor.submit(self._commit, batch).result()
+        self.executor.submit(self.connection.close).result()
+        self.executor.shutdown()
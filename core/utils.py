@@ -1,4 +1,3 @@
-import discord
 from discord.ext import commands
 
 
@@ -30,5 +29,20 @@ def codeblock(string):
     return f'```{string}```'
 
 
+async def set_roles(member, add=(), remove_ids=frozenset()):
+    """Adds the roles :add: to a member and removes all roles whose ids are in :remove_ids:
+    with a single API call. Returns False if the roles of the member were already right."""
+    current = [role for role in member.roles if not role.is_default()]
+    target = [role for role in current if role.id not in remove_ids]
+    for role in add:
+        if role not in target:
+            target.append(role)
+
+    if set(target) == set(current):
+        return False
+    await member.edit(roles=target)
+    return True
+
+
 def get_member(bot, user):
-    return discord.utils.get(bot.guild.members, id=user.id)
+    return bot.get_member(user.id)
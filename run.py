@@ -1,3 +1,6 @@
+import time
+startup_times = {'start': time.perf_counter()}
+
 import os
 import pathlib
 import sys
@@ -8,16 +11,19 @@ import discord
 import yaml
 
 from core.bot import UfffBot
-from core.configvalidator import validate
+from core.configvalidator import load as load_config
 from core.help import DefaultHelpCommand
 
 
 __version__ = '0.3'
 
+startup_times['import'] = time.perf_counter()
+
 
 # set up argument parsing
 parser = argparse.ArgumentParser()
 parser.add_argument('--debug', help='start the bot and set logging level to debug', action='store_true')
+parser.add_argument('--profile-startup', help='print how long each stage of the startup took', action='store_true')
 args = parser.parse_args()
 
 
@@ -31,9 +37,9 @@ logging.basicConfig(format='%(levelname)s:%(message)s', level=loglvl)
 
 
 # load config file
+configpath = pathlib.Path(__file__).absolute().parent/'config.yml'
 try:
-    with open('config.yml', 'r') as file:
-        config = validate(yaml.load(file, Loader=yaml.Loader))
+    config = load_config(configpath)
 except FileNotFoundError:
     logging.warning('No configuration file found')
 
@@ -73,7 +79,8 @@ intents.members = True
 intents.reactions = True
 
 # start bot
-bot = UfffBot('!', config, secrets, datapath, intents=intents, help_command=DefaultHelpCommand())
+bot = UfffBot('!', config, secrets, datapath, configpath, startup_times, args.profile_startup,
+              intents=intents, help_command=DefaultHelpCommand())
 try:
     bot.run(token)
 except discord.LoginFailure:
@@ -0,0 +1,71 @@
+import asyncio
+import types
+
+import discord
+
+from core.broadcast import Broadcaster
+from core.setup import SetupDialogs, setup_dialog
+
+
+class FakeStore:
+    def __init__(self):
+        self.dialogs = {}
+
+    def __len__(self):
+        return len(self.dialogs)
+
+    def __contains__(self, member_id):
+        return member_id in self.dialogs
+
+    def put(self, member_id, state, name=None, group_name=None, updated=None):
+        self.dialogs[member_id] = state
+
+    def delete(self, member_id):
+        self.dialogs.pop(member_id, None)
+
+
+class FakeMember:
+    def __init__(self, member_id, accepts_dms=True):
+        self.id = member_id
+        self.accepts_dms = accepts_dms
+        self.sent = 0
+
+    async def send(self, content=None, embed=None):
+        if not self.accepts_dms:
+            response = types.SimpleNamespace(status=403, reason='Forbidden')
+            raise discord.Forbidden(response, 'Cannot send messages to this user')
+        self.sent += 1
+
+
+class FakeChannel:
+    def __init__(self):
+        self.id = 10
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+
+def test_broadcast_records_members_that_can_not_be_messaged(tmp_path):
+    members = {member_id: FakeMember(member_id, accepts_dms=member_id != 3) for member_id in range(1, 6)}
+    channel = FakeChannel()
+    bot = types.SimpleNamespace(get_member=members.get, get_channel=lambda channel_id: channel)
+    bot.setup_dialogs = SetupDialogs(bot, FakeStore())
+
+    async def broadcast():
+        broadcaster = Broadcaster(bot, tmp_path / 'broadcasts', {'setup': setup_dialog})
+        # the same member twice and one that left the server
+        job = broadcaster.create('setup', [members[1], members[1], *members.values(), FakeMember(9)], channel)
+        broadcaster.start(job)
+        await broadcaster.jobs[job.id]
+        return job
+
+    job = asyncio.run(broadcast())
+
+    assert job.recipients == [1, 2, 3, 4, 5, 9]
+    assert set(job.failures) == {3, 9}
+    assert [member.sent for member in members.values()] == [1, 1, 0, 1, 1]
+    # no dialog waits for the answer of the member that never got the message
+    assert 3 not in bot.setup_dialogs.store
+    assert 'abgeschlossen: 4 von 6 erfolgreich' in channel.sent[0]
+    assert list((tmp_path / 'broadcasts').glob('*.json')) == []
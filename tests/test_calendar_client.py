@@ -0,0 +1,40 @@
+import asyncio
+import os
+import pickle
+import time
+
+from core.calendar import CalendarClient
+from core.storage import Storage
+
+
+def write_pickle(path, credentials, modified):
+    with open(path, 'wb') as file:
+        pickle.dump(credentials, file)
+    os.utime(path, (modified, modified))
+
+
+def test_credentials_of_a_new_authorisation_replace_the_stored_ones(tmp_path):
+    tokenpath = tmp_path / 'token.pickle'
+    write_pickle(tokenpath, {'token': 'first'}, time.time() - 3600)
+    storage = Storage(tmp_path / 'uf3bot.db')
+    client = CalendarClient(storage, tokenpath=tokenpath)
+
+    # without stored credentials the pickle is read
+    client.load_credentials()
+    assert client.credentials == {'token': 'first'}
+
+    # a refreshed token is stored and wins over the older pickle
+    async def save():
+        client.credentials = {'token': 'refreshed'}
+        client.save_credentials()
+        await storage.flush()
+    asyncio.run(save())
+    client.load_credentials()
+    assert client.credentials == {'token': 'refreshed'}
+
+    # running googleauth.py again writes a newer pickle
+    write_pickle(tokenpath, {'token': 'reauthorised'}, time.time() + 60)
+    client.load_credentials()
+    assert client.credentials == {'token': 'reauthorised'}
+
+    storage.close()
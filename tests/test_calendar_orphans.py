@@ -0,0 +1,58 @@
+import asyncio
+import types
+
+from core.calendar import Calendar
+
+
+class FakeMessage:
+    def __init__(self, message_id, author):
+        self.id = message_id
+        self.author = author
+        self.embeds = ['embed']
+
+
+class FakeChannel:
+    """A channel whose history yields its messages and runs :during_history: in between,
+    like a reminder sending its message while the history is fetched"""
+
+    def __init__(self, channel_id, messages, during_history=None):
+        self.id = channel_id
+        self.messages = messages
+        self.during_history = during_history
+        self.history_kwargs = None
+        self.deleted = []
+
+    async def history(self, **kwargs):
+        self.history_kwargs = kwargs
+        for message in self.messages:
+            if self.during_history:
+                self.during_history()
+            yield message
+
+    async def delete_messages(self, messages):
+        self.deleted.extend(message.id for message in messages)
+
+
+class FakeStorage:
+    def write(self, sql, params=()):
+        pass
+
+
+def test_delete_orphans_keeps_messages_of_reminders_sent_during_the_scan():
+    user = object()
+    reminders = {}
+    new_message = FakeMessage(3, user)
+
+    def send_reminder():
+        reminders['event'] = types.SimpleNamespace(message=new_message)
+
+    channel = FakeChannel(10, [FakeMessage(2, user), new_message], during_history=send_reminder)
+    bot = types.SimpleNamespace(user=user, storage=FakeStorage(), get_channel={10: channel}.get)
+    cog = types.SimpleNamespace(bot=bot, reminders=reminders, channels={'admin': channel},
+                                stored_messages={'gone': (10, 1)})
+
+    asyncio.run(Calendar.delete_orphans(cog))
+
+    assert sorted(channel.deleted) == [1, 2]
+    assert 'before' in channel.history_kwargs
+    assert cog.stored_messages == {}
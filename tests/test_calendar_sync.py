@@ -0,0 +1,71 @@
+import datetime
+
+from core.calendar import CalendarSync, TIMEZONE
+
+
+NOW = TIMEZONE.localize(datetime.datetime(2026, 10, 19, 8, 0))
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self, http=None):
+        return self.response
+
+
+class FakeEvents:
+    """An events resource answering every list request with the next prepared response"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def list(self, **kwargs):
+        self.requests.append(kwargs)
+        return FakeRequest(self.responses.pop(0))
+
+    def list_next(self, request, response):
+        return None
+
+
+class FakeService:
+    def __init__(self, events):
+        self._events = events
+
+    def events(self):
+        return self._events
+
+
+class FakeClient:
+    http = None
+
+
+def lecture(event_id, hours, status='confirmed'):
+    start = NOW + datetime.timedelta(hours=hours)
+    return {'id': event_id, 'status': status, 'updated': '2026-10-01T00:00:00.000Z',
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + datetime.timedelta(hours=1)).isoformat()}}
+
+
+def test_incremental_sync_keeps_recurring_entries_expanded():
+    events = FakeEvents([
+        {'items': [lecture('abc_20261019T080000Z', 1), lecture('abc_20261026T080000Z', 169)],
+         'nextSyncToken': 'first'},
+        {'items': [lecture('abc_20261019T080000Z', 1, status='cancelled')], 'nextSyncToken': 'second'},
+    ])
+    sync = CalendarSync(FakeClient(), clock=lambda: NOW)
+    try:
+        sync.sync_events(FakeService(events), 'lectures')
+        sync.sync_events(FakeService(events), 'lectures')
+    finally:
+        sync.close()
+
+    full, incremental = events.requests
+    assert full['singleEvents'] and incremental['singleEvents']
+    assert 'timeMin' in full and 'syncToken' not in full
+    assert 'timeMin' not in incremental and incremental['syncToken'] == 'first'
+
+    assert list(sync.events['lectures']) == ['abc_20261026T080000Z']
+    assert sync.sync_tokens['lectures'] == 'second'
+    assert len(sync.timeline) == 1
@@ -0,0 +1,90 @@
+import random
+
+from core.calendar import countdown, countdown_change, format_seconds
+
+
+# format_seconds as it was before the countdown texts were interned
+def reference_format_seconds(seconds):
+    dayflag = False
+    hourflag = False
+
+    if seconds > 0:
+        output = 'in '
+    else:
+        seconds *= -1
+        output = 'seit '
+
+    # Tage
+    days = int(seconds / 86400)
+    if days >= 1:
+        dayflag = True
+        if days < 2:
+            output += 'einem Tag'
+        else:
+            output += f'{days} Tagen'
+        seconds -= days * 86400
+
+    # Stunden
+    hours = int(seconds / 3600)
+    if hours >= 1:
+        hourflag = True
+        if dayflag:
+            output += ' und '
+        if hours < 2:
+            output += 'einer Stunde'
+        else:
+            output += f'{hours} Stunden'
+        seconds -= hours * 3600
+    elif dayflag:
+        output += '.'
+        return output
+
+    if hourflag and dayflag:
+        return output
+
+    else:
+        output += ' und '
+    # Minuten
+    minutes = int(seconds / 60)
+    if minutes >= 2:
+        output += f'{minutes} Minuten.'
+    elif minutes >= 1:
+        output += 'einer Minute.'
+    else:
+        output += 'weniger als einer Minute.'
+
+    return output
+
+
+def samples(count=100000, seed=24):
+    """Random seconds up to ten days away plus the values around every unit boundary"""
+    generator = random.Random(seed)
+    values = [generator.uniform(-864000, 864000) for _ in range(count)]
+    values += [generator.randint(-864000, 864000) for _ in range(count)]
+    for unit in (60, 3600, 86400):
+        for multiple in range(-240, 241):
+            for offset in (-0.5, -1e-9, 0, 1e-9, 0.5):
+                values.append(multiple * unit + offset)
+    return values
+
+
+def test_format_seconds_matches_the_reference():
+    for seconds in samples():
+        assert format_seconds(seconds) == reference_format_seconds(seconds), seconds
+
+
+def test_countdown_changes_exactly_when_the_text_changes():
+    for seconds in samples(count=20000):
+        text, change = countdown(seconds)
+        assert change == countdown_change(seconds)
+        assert 0 <= change <= 3600
+        if change > 0.002:
+            assert reference_format_seconds(seconds - change + 0.001) == text, seconds
+        assert reference_format_seconds(seconds - change - 0.001) != text, seconds
+
+
+def test_known_texts():
+    assert format_seconds(300.5) == 'in  und 5 Minuten.'
+    assert format_seconds(2 * 86400) == 'in 2 Tagen.'
+    assert format_seconds(2 * 86400 + 3 * 3600 + 5) == 'in 2 Tagen und 3 Stunden'
+    assert format_seconds(-3600 - 120) == 'seit einer Stunde und 2 Minuten.'
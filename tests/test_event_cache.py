@@ -0,0 +1,39 @@
+import datetime
+
+import dateutil.parser
+
+from core.calendar import EventCache, TIMEZONE, parse_datetime
+
+
+def entry(event_id, updated='2026-10-01T00:00:00.000Z', summary='Vorlesung'):
+    return {'id': event_id, 'updated': updated, 'summary': summary, 'organizer': {'displayName': 'BAC1A'},
+            'description': '<p>Bitte <b>Laptop</b> mitbringen</p>',
+            'start': {'dateTime': '2026-10-19T08:00:00+02:00'}, 'end': {'dateTime': '2026-10-19T09:30:00+02:00'}}
+
+
+def test_fast_path_matches_dateutil():
+    for string in ('2026-10-19T08:00:00+02:00', '2026-10-19T06:00:00Z', '2026-10-01T12:34:56.789Z',
+                   '2026-03-29T01:30:00-05:00'):
+        assert parse_datetime(string) == dateutil.parser.parse(string).astimezone(TIMEZONE)
+        assert parse_datetime(string).tzinfo.zone == 'Europe/Berlin'
+
+
+def test_entries_are_parsed_again_only_after_they_changed():
+    cache = EventCache()
+    first = cache.get(entry('a'))
+    assert cache.get(entry('a')) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    changed = cache.get(entry('a', updated='2026-10-02T00:00:00.000Z', summary='Übung'))
+    assert changed.summary == 'Übung' and first.summary == 'Vorlesung'
+    assert changed.event_duration == datetime.timedelta(hours=1, minutes=30)
+    assert 'Laptop' in changed.description and '<b>' not in changed.description
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = EventCache(maxsize=2)
+    cache.get(entry('a'))
+    cache.get(entry('b'))
+    cache.get(entry('a'))
+    cache.get(entry('c'))
+    assert [key[0] for key in cache.entries] == ['a', 'c']
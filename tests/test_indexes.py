@@ -0,0 +1,78 @@
+import asyncio
+import types
+
+from core.bot import UfffBot
+
+
+class FakeRole:
+    def __init__(self, role_id, guild):
+        self.id = role_id
+        self.name = f'role{role_id}'
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, guild_id, member_count=10000):
+        self.id = guild_id
+        self.name = 'ET'
+        self.roles = [FakeRole(role_id, self) for role_id in range(1, 20)]
+        self.channels = [types.SimpleNamespace(id=channel_id, guild=self) for channel_id in range(100, 110)]
+        self._members = {member_id: types.SimpleNamespace(id=member_id) for member_id in range(member_count)}
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+
+class IndexedBot(UfffBot):
+    # replaces the guilds of the connection state
+    guilds = []
+
+
+def indexed_bot(guild):
+    """Returns a bot with only the state parse_config needs, no connection or storage"""
+    bot = IndexedBot.__new__(IndexedBot)
+    IndexedBot.guilds = [guild]
+    bot.guild = None
+    bot.roles, bot.channels, bot.semesters, bot.study_groups = {}, {}, [], []
+    bot.config = {'bot': {'prefix': '!', 'presence': ''},
+                  'server': {'id': guild.id,
+                             'roles': {'student': 1, 'gast': 2},
+                             'channels': {'admin_calendar': 100},
+                             'semesters': {1: {'channel': 101, 'groups': {'BAC1A': 10, 'BAC1B': 11}},
+                                           2: {'channel': 102, 'groups': {'2W': 12}}}}}
+    bot.parse_config()
+    return bot
+
+
+def test_parse_config_builds_the_indexes():
+    guild = FakeGuild(42)
+    bot = indexed_bot(guild)
+
+    assert bot.roles['gast'].id == 2 and bot.channels['admin_calendar'].id == 100
+    assert sorted(bot.groups_by_name) == ['2W', 'BAC1A', 'BAC1B']
+    assert bot.groups_by_name['BAC1B'].semester.channel.id == 101
+    assert bot.group_role_ids == {10, 11, 12}
+    assert bot.get_member(9999).id == 9999 and bot.get_member(10000) is None
+
+
+def test_indexes_follow_guild_events():
+    guild = FakeGuild(42)
+    bot = indexed_bot(guild)
+
+    async def events():
+        new_role = FakeRole(30, guild)
+        await bot.on_guild_role_create(new_role)
+        assert bot.role_index[30] is new_role
+
+        await bot.on_guild_role_delete(bot.role_index[11])
+        await bot.on_guild_channel_delete(bot.channel_index[102])
+        # events of other guilds are ignored
+        await bot.on_guild_role_delete(FakeRole(10, FakeGuild(7, member_count=0)))
+
+    asyncio.run(events())
+
+    assert 11 not in bot.role_index and 102 not in bot.channel_index
+    assert sorted(bot.groups_by_name) == ['2W', 'BAC1A']
+    assert bot.group_role_ids == {10, 12}
+    assert [group.name for group in bot.semesters[0].groups] == ['BAC1A']
+    assert bot.semesters[1].channel is None
@@ -0,0 +1,230 @@
+import asyncio
+import datetime
+import types
+
+from core.calendar import Calendar, CalendarSync, EventTimeline, Reminder, ReminderContext, ReminderScheduler, TIMEZONE
+
+
+START = TIMEZONE.localize(datetime.datetime(2026, 10, 19, 8, 0))
+
+
+class FrozenClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += datetime.timedelta(**kwargs)
+
+
+def entry(event_id, starts_in, duration=datetime.timedelta(hours=1), remind_minutes=30):
+    start = START + starts_in
+    return {'id': event_id, 'updated': '2026-10-01T00:00:00.000Z', 'summary': f'Vorlesung {event_id}',
+            'organizer': {'displayName': 'BAC1A'},
+            'reminders': {'overrides': [{'minutes': remind_minutes}]},
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': (start + duration).isoformat()}}
+
+
+def test_timeline_hands_out_entries_within_the_window_in_reminder_order():
+    clock = FrozenClock(START)
+    sync = CalendarSync(None, lookahead=datetime.timedelta(days=7), clock=clock)
+    entries = [entry('late', datetime.timedelta(days=3)), entry('outside', datetime.timedelta(days=8)),
+               entry('soon', datetime.timedelta(minutes=20)), entry('early', datetime.timedelta(hours=2),
+                                                                    remind_minutes=180)]
+    sync.events['lectures'] = {}
+    for calendar_entry in entries:
+        sync.events['lectures'][calendar_entry['id']] = calendar_entry
+        sync.timeline.add('lectures', calendar_entry)
+    sync.close()
+
+    assert [item['id'] for item in sync.upcoming()] == ['early', 'soon', 'late']
+
+    # finished entries are forgotten, the window moves with the clock
+    clock.advance(days=2)
+    assert [item['id'] for item in sync.upcoming()] == ['late', 'outside']
+    assert sorted(sync.events['lectures']) == ['late', 'outside']
+    assert len(sync.timeline) == 2
+
+
+def test_timeline_moves_and_removes_entries():
+    timeline = EventTimeline()
+    timeline.add('lectures', entry('a', datetime.timedelta(hours=1)))
+    timeline.add('lectures', entry('b', datetime.timedelta(hours=2)))
+    timeline.add('lectures', entry('a', datetime.timedelta(hours=3)))
+    assert [item['id'] for item in timeline.due(START + datetime.timedelta(days=1))] == ['b', 'a']
+
+    timeline.remove('b')
+    timeline.remove('unknown')
+    assert [item['id'] for item in timeline.due(START + datetime.timedelta(days=1))] == ['a']
+    assert timeline.due(START) == []
+
+
+class FakeMessage:
+    def __init__(self, channel, embed):
+        self.id = len(channel.sent)
+        self.channel = channel
+        self.embed = embed
+        self.deleted = False
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChannel:
+    id = 10
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, embed):
+        message = FakeMessage(self, embed)
+        self.sent.append(message)
+        return message
+
+
+class FakeEdits:
+    def __init__(self):
+        self.edits = []
+
+    def edit(self, message, embed):
+        self.edits.append(embed.title)
+
+    def discard(self, message):
+        pass
+
+
+class FakeStorage:
+    def write(self, sql, params=()):
+        pass
+
+
+def test_reminders_are_promoted_by_the_scheduler_with_a_frozen_clock():
+    clock = FrozenClock(START)
+    scheduler = ReminderScheduler(clock)
+    edits = FakeEdits()
+    reminders = {}
+    context = ReminderContext(scheduler, edits, FakeStorage(), reminders, clock)
+    channel = FakeChannel()
+
+    async def run_due():
+        for reminder in scheduler.pop_due(clock()):
+            await reminder.refresh()
+        # let the message deletions run
+        await asyncio.sleep(0)
+
+    async def scenario():
+        calendar_entry = entry('lecture', datetime.timedelta(days=2), remind_minutes=30)
+        reminders['lecture'] = Reminder(context, calendar_entry, channel)
+        await run_due()
+        # waits for its reminder time without sending anything
+        assert channel.sent == [] and scheduler.pending == 1
+
+        clock.advance(days=2, minutes=-30)
+        await run_due()
+        assert [message.embed.title for message in channel.sent] == ['**BAC1A**:  Vorlesung lecture in  und 30 Minuten.']
+
+        # sent at exactly 30 minutes, the countdown changes right after
+        clock.advance(seconds=1)
+        await run_due()
+        assert edits.edits == ['**BAC1A**:  Vorlesung lecture in  und 29 Minuten.']
+
+        # nothing is due until the countdown changes again
+        clock.advance(seconds=30)
+        assert scheduler.pop_due(clock()) == []
+        clock.advance(seconds=30)
+        await run_due()
+        assert edits.edits[1:] == ['**BAC1A**:  Vorlesung lecture in  und 28 Minuten.']
+
+        clock.advance(hours=2)
+        await run_due()
+        assert reminders == {} and scheduler.pending == 0
+        assert channel.sent[0].deleted
+
+    asyncio.run(scenario())
+
+
+class SlowChannel(FakeChannel):
+    """Holds every message back until :attr:`release` is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send(self, embed):
+        await self.release.wait()
+        return await super().send(embed)
+
+
+def test_refreshes_of_a_reminder_never_overlap():
+    clock = FrozenClock(START)
+    scheduler = ReminderScheduler(clock)
+    reminders = {}
+    context = ReminderContext(scheduler, FakeEdits(), FakeStorage(), reminders, clock)
+    channel = SlowChannel()
+
+    async def scenario():
+        calendar_entry = entry('updated', datetime.timedelta(minutes=10))
+        reminder = reminders['updated'] = Reminder(context, calendar_entry, channel)
+        first = asyncio.create_task(reminder.refresh())
+        await asyncio.sleep(0)
+
+        # updated while the message is still being sent
+        reminder.update_reminder(dict(calendar_entry, summary='Klausur'))
+        for due in scheduler.pop_due(clock()):
+            await due.refresh()
+        channel.release.set()
+        await first
+
+        assert len(channel.sent) == 1 and reminder.message is channel.sent[0]
+        # the update is refreshed right after the message was sent
+        assert scheduler.pop_due(clock()) == [reminder]
+
+    asyncio.run(scenario())
+
+
+def test_a_message_sent_after_the_reminder_was_deleted_is_deleted():
+    clock = FrozenClock(START)
+    scheduler = ReminderScheduler(clock)
+    reminders = {}
+    context = ReminderContext(scheduler, FakeEdits(), FakeStorage(), reminders, clock)
+    channel = SlowChannel()
+
+    async def scenario():
+        reminder = reminders['deleted'] = Reminder(context, entry('deleted', datetime.timedelta(minutes=10)), channel)
+        refresh = asyncio.create_task(reminder.refresh())
+        await asyncio.sleep(0)
+
+        reminder.delete_reminder()
+        channel.release.set()
+        await refresh
+
+        assert len(channel.sent) == 1 and channel.sent[0].deleted
+        assert reminders == {} and scheduler.pending == 0
+
+    asyncio.run(scenario())
+
+
+class FakeTextChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+
+
+def test_ongoing_ignores_reminders_waiting_for_their_reminder_time():
+    waiting = types.SimpleNamespace(is_running=False)
+    running = types.SimpleNamespace(is_running=True, event=types.SimpleNamespace(calendar_name='BAC1A',
+                                                                                  summary='Vorlesung'))
+    channel = FakeTextChannel()
+    context = types.SimpleNamespace(channel=channel)
+
+    asyncio.run(Calendar.ongoing.callback(types.SimpleNamespace(reminders={'waiting': waiting}), context))
+    asyncio.run(Calendar.ongoing.callback(types.SimpleNamespace(reminders={'waiting': waiting, 'running': running}),
+                                          context))
+
+    assert channel.sent[0] == 'Es gibt momentan keine laufenden Termine!'
+    assert 'BAC1A: Vorlesung' in channel.sent[1]
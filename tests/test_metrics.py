@@ -0,0 +1,47 @@
+import asyncio
+
+from core.metrics import Metrics, serve
+
+
+def test_large_counts_are_not_rounded():
+    metrics = Metrics()
+    counter = metrics.counter('uf3bot_test_total', 'A counter')
+    histogram = metrics.histogram('uf3bot_test_seconds', 'A histogram', buckets=(0.5, 1))
+    counter.inc(amount=1234567)
+    for _ in range(3):
+        histogram.observe(0.1)
+    histogram.values[()][2] = 10 ** 7 + 1
+
+    text = metrics.render()
+    assert 'uf3bot_test_total 1234567\n' in text
+    assert 'uf3bot_test_seconds_bucket{le="0.5"} 3\n' in text
+    assert 'uf3bot_test_seconds_bucket{le="+Inf"} 10000001\n' in text
+    assert 'uf3bot_test_seconds_count 10000001\n' in text
+    assert 'uf3bot_test_seconds_sum 0.30000000000000004\n' in text
+
+
+def test_labels_are_escaped_and_gauges_collected():
+    metrics = Metrics()
+    metrics.gauge('uf3bot_dialogs', 'Dialogs', ('kind',), collect=lambda: {('a "b"',): 2})
+    assert 'uf3bot_dialogs{kind="a \\"b\\""} 2\n' in metrics.render()
+    assert metrics.summary() == 'uf3bot_dialogs a "b": 2\n'
+
+
+def test_endpoint_serves_the_metrics():
+    metrics = Metrics()
+    metrics.counter('uf3bot_test_total', 'A counter').inc()
+
+    async def scrape():
+        server = await serve(metrics, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response.decode()
+
+    response = asyncio.run(scrape())
+    assert response.startswith('HTTP/1.1 200 OK\r\n')
+    assert response.endswith('uf3bot_test_total 1\n')
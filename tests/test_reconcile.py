@@ -0,0 +1,31 @@
+import types
+
+from core.calendar import reconcile
+
+
+def reminder(event_id, updated):
+    return types.SimpleNamespace(id=event_id, updated_stamp=updated)
+
+
+def test_reconcile_sorts_entries_into_added_updated_and_deleted():
+    reminders = {'same': reminder('same', '1'), 'changed': reminder('changed', '1'), 'gone': reminder('gone', '1')}
+    events = [{'id': 'same', 'updated': '1'}, {'id': 'changed', 'updated': '2'}, {'id': 'new', 'updated': '1'}]
+
+    added, updated, deleted = reconcile(reminders, events)
+
+    assert [event['id'] for event in added] == ['new']
+    assert [(found.id, event['updated']) for found, event in updated] == [('changed', '2')]
+    assert deleted == [reminders['gone']]
+    # the reminders are left to the caller
+    assert sorted(reminders) == ['changed', 'gone', 'same']
+
+
+def test_reconcile_handles_thousands_of_entries():
+    reminders = {f'event{index}': reminder(f'event{index}', '1') for index in range(0, 5000, 2)}
+    events = [{'id': f'event{index}', 'updated': '2' if index % 10 == 0 else '1'} for index in range(2500, 7500)]
+
+    added, updated, deleted = reconcile(reminders, events)
+
+    assert len(added) == 3750
+    assert len(updated) == 250
+    assert len(deleted) == 1250
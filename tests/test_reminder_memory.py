@@ -0,0 +1,39 @@
+import datetime
+import tracemalloc
+
+from core.calendar import Reminder, ReminderContext, TIMEZONE
+from core.models import Semester, StudyGroup
+
+
+class FakeScheduler:
+    def schedule(self, reminder, when):
+        pass
+
+
+def test_bytes_per_reminder():
+    start = TIMEZONE.localize(datetime.datetime(2026, 10, 19, 8, 0))
+    entry = {'id': 'lecture', 'updated': '2026-10-01T00:00:00.000Z', 'summary': 'Vorlesung',
+             'organizer': {'displayName': 'BAC1A'}, 'description': '<b>Raum</b> R1.007',
+             'start': {'dateTime': start.isoformat()},
+             'end': {'dateTime': (start + datetime.timedelta(hours=1)).isoformat()}}
+    context = ReminderContext(FakeScheduler(), None, None, {}, lambda: start)
+    # parse the shared entry before measuring, only the state of the reminders is counted
+    Reminder(context, entry, channel=None)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    reminders = [Reminder(context, entry, channel=None) for _ in range(10000)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    per_reminder = allocated / len(reminders)
+    print(f'{per_reminder:.0f} bytes per reminder')
+    assert not hasattr(reminders[0], '__dict__')
+    assert per_reminder < 160
+
+
+def test_models_are_slotted():
+    semester = Semester(1)
+    group = StudyGroup('BAC1A', None, semester)
+    assert not hasattr(semester, '__dict__') and not hasattr(group, '__dict__')
@@ -0,0 +1,109 @@
+import asyncio
+import http.server
+import threading
+
+import discord
+
+from core.metrics import Metrics
+from core.rss import EditQueue, Feed
+
+
+FEED = b'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>HM</title><link>https://example.org/</link>
+<item><title>Neuigkeit</title><link>https://example.org/1</link><guid>1</guid></item>
+</channel></rss>'''
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 19 Oct 2026 08:00:00 GMT'
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(FEED)))
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_second_fetch_is_conditional_and_skipped_on_304():
+    server = http.server.HTTPServer(('127.0.0.1', 0), FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/feed.xml'
+    fetch_time = Metrics().histogram('uf3bot_feed_fetch_seconds', 'Fetch time', ('feed',))
+    feed = Feed('hm', url, channel=None, seen=None, edit_queue=None, interval=30, fetch_time=fetch_time)
+
+    async def fetch_twice():
+        return await feed.fetch(), await feed.fetch()
+
+    try:
+        first, second = asyncio.run(fetch_twice())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [entry['link'] for entry in first['entries']] == ['https://example.org/1']
+    assert second is None
+
+    initial, conditional = FeedHandler.requests
+    assert 'If-None-Match' not in initial and 'If-Modified-Since' not in initial
+    assert conditional['If-None-Match'] == ETAG
+    assert conditional['If-Modified-Since'] == LAST_MODIFIED
+    assert fetch_time.values[('hm',)][2] == 2
+
+
+class FakeFeedMessage:
+    def __init__(self, channel, embeds=()):
+        self.id = 1
+        self.channel = channel
+        self.embeds = list(embeds)
+        self.edited = None
+
+    async def edit(self, content=None, embed=None):
+        self.edited = embed
+
+
+class FakeFeedChannel:
+    """Unfurls the link of the sent message on the second fetch"""
+
+    def __init__(self):
+        self.fetches = 0
+        self.fetched = []
+
+    async def fetch_message(self, message_id):
+        self.fetches += 1
+        embeds = [discord.Embed(title='Neuigkeiten')] if self.fetches > 1 else []
+        self.fetched.append(FakeFeedMessage(self, embeds))
+        return self.fetched[-1]
+
+
+def test_embed_edits_read_the_unfurled_embed_of_the_fetched_message():
+    channel = FakeFeedChannel()
+    sent = FakeFeedMessage(channel)
+    queue = EditQueue()
+    entry = {'link': 'https://example.com/news', 'title': 'Neuigkeiten', 'summary': 'Text'}
+
+    async def edit():
+        # not unfurled yet, retried later
+        await queue.edit(sent, entry, 0)
+        due, _, message, queued_entry, attempt = queue._heap[0]
+        await queue.edit(message, queued_entry, attempt)
+        queue.stop()
+
+    asyncio.run(edit())
+
+    assert queue.retries == 1 and queue.fallbacks == 0
+    assert channel.fetched[-1].edited.description == 'Text'
+    assert sent.edited is None
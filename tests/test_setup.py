@@ -0,0 +1,148 @@
+import asyncio
+import time
+import types
+
+import discord
+
+from core.broadcast import TokenBucket
+from core.models import Semester, StudyGroup
+from core.setup import AWAITING_GROUP, AWAITING_NAME, DIALOG_EXPIRY, SetupDialogs, SetupStore
+from core.storage import Storage
+
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+
+    def is_default(self):
+        return False
+
+
+class FakeMember:
+    def __init__(self, member_id):
+        self.id = member_id
+        self.name = f'member{member_id}'
+        self.nick = None
+        self.roles = []
+        self.sent = []
+
+    async def send(self, content=None, embed=None):
+        # give the other dialogs a chance to run in between
+        await asyncio.sleep(0)
+        self.sent.append(embed)
+
+    async def edit(self, nick=None, roles=None):
+        if nick is not None:
+            self.nick = nick
+        if roles is not None:
+            self.roles = roles
+
+
+def fake_bot(members):
+    semester = Semester(1)
+    groups = {}
+    for index, name in enumerate(['BAC1A', 'BAC1B']):
+        group = StudyGroup(name, FakeRole(100 + index, name), semester)
+        semester.groups.append(group)
+        groups[name] = group
+
+    return types.SimpleNamespace(
+        command_prefix='!', semesters=[semester], groups_by_name=groups,
+        roles={'student': FakeRole(1, 'student'), 'gast': FakeRole(2, 'gast')},
+        group_role_ids=frozenset(group.role.id for group in groups.values()),
+        get_member={member.id: member for member in members}.get,
+        broadcaster=types.SimpleNamespace(bucket=TokenBucket(10000, 10000)))
+
+
+def message(member, content):
+    return types.SimpleNamespace(author=member, content=content, guild=None)
+
+
+def test_thousand_concurrent_onboardings(tmp_path):
+    members = [FakeMember(member_id) for member_id in range(1000, 2000)]
+    bot = fake_bot(members)
+
+    async def onboard():
+        storage = Storage(tmp_path / 'uf3bot.db')
+        dialogs = SetupDialogs(bot, SetupStore(storage))
+        await asyncio.gather(*(dialogs.start(member) for member in members))
+        assert len(dialogs) == 1000
+
+        await asyncio.gather(*(dialogs.handle(message(member, 'Max Mustermann')) for member in members))
+        await asyncio.gather(*(dialogs.handle(message(member, ['bac1a', 'BAC1B', 'gast'][member.id % 3]))
+                               for member in members))
+        await storage.flush()
+        assert len(dialogs) == 0
+        assert storage.query('SELECT COUNT(*) FROM setup') == [(0,)]
+        storage.close()
+
+    asyncio.run(onboard())
+
+    for member in members:
+        expected = {1, [100, 101, 2][member.id % 3]}
+        assert {role.id for role in member.roles} == expected
+        assert member.nick == 'Max Mustermann'
+        # start, group selection and end of the dialog
+        assert len(member.sent) == 3
+
+
+def test_resume_keeps_the_age_of_dialogs(tmp_path):
+    recent, abandoned, choosing = FakeMember(1), FakeMember(2), FakeMember(3)
+    bot = fake_bot([recent, abandoned, choosing])
+    updated = time.time() - 24 * 3600
+
+    async def resume():
+        storage = Storage(tmp_path / 'uf3bot.db')
+        store = SetupStore(storage)
+        store.put(recent.id, AWAITING_NAME, updated=updated)
+        store.put(abandoned.id, AWAITING_NAME, updated=time.time() - DIALOG_EXPIRY - 1)
+        store.put(choosing.id, AWAITING_GROUP, 'Erika', updated=updated)
+
+        await SetupDialogs(bot, store).resume()
+        storage.close()
+        return store
+
+    store = asyncio.run(resume())
+
+    assert store.get(recent.id) == (AWAITING_NAME, None, None, updated)
+    assert store.get(choosing.id) == (AWAITING_GROUP, 'Erika', None, updated)
+    assert abandoned.id not in store
+    assert isinstance(recent.sent[0], discord.Embed) and len(choosing.sent) == 1
+    assert abandoned.sent == []
+
+
+class GatedBucket:
+    """A token bucket that hands out no token until :attr:`open` is set"""
+
+    def __init__(self):
+        self.open = asyncio.Event()
+
+    async def acquire(self):
+        await self.open.wait()
+
+
+def test_resume_skips_dialogs_answered_while_waiting_for_the_bucket(tmp_path):
+    answering = FakeMember(1)
+    bot = fake_bot([answering])
+    bot.broadcaster.bucket = GatedBucket()
+
+    async def resume():
+        storage = Storage(tmp_path / 'uf3bot.db')
+        store = SetupStore(storage)
+        store.put(answering.id, AWAITING_NAME)
+        dialogs = SetupDialogs(bot, store)
+
+        resuming = asyncio.create_task(dialogs.resume())
+        await asyncio.sleep(0)
+        await dialogs.handle(message(answering, 'Max Mustermann'))
+        bot.broadcaster.bucket.open.set()
+        await resuming
+        storage.close()
+        return store
+
+    store = asyncio.run(resume())
+
+    # only the group selection, not the name prompt again
+    assert len(answering.sent) == 1
+    assert store.get(answering.id)[:2] == (AWAITING_GROUP, 'Max Mustermann')